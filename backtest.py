@@ -0,0 +1,245 @@
+import argparse
+import os
+import time
+import warnings
+from concurrent.futures import wait, FIRST_COMPLETED
+from functools import partial
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from db import get_engine
+from bulk_load import copy_to_temp_table
+from sarima_pool import fit_sarima, select_order, blas_limited_pool, DEFAULT_ORDER
+from batch_forecast import pad_series, batch_forecast, METHODS
+
+warnings.filterwarnings("ignore")
+
+# ============================
+# Rolling-origin backtest of the forecasting engines
+# ============================
+engine = get_engine('backtest')
+
+pollutants = ['pm10', 'pm25', 'no2']
+MIN_TRAIN = 5  # SARIMA needs enough points
+
+
+def read_series():
+    return pd.read_sql("""
+    SELECT a.location_id, COALESCE(l.region, 'unknown') AS region, a.year, a.pm10, a.pm25, a.no2
+    FROM dw.feat_air_quality_series a
+    JOIN dw.dim_location l ON l.location_id = a.location_id
+    ORDER BY a.location_id, a.year
+    """, engine)
+
+
+def build_folds(df, n_folds, horizon):
+    """One task per (pollutant, location, cut-off year) over the last `n_folds` years.
+
+    task = (pollutant, location_id, region, cutoff, train_values, test_years, test_values):
+    train on years < cutoff, score the next `horizon` observed points.
+    """
+    cutoffs = sorted(df['year'].unique())[-n_folds:]
+    tasks = []
+    for pol in pollutants:
+        series = df[['location_id', 'region', 'year', pol]].dropna()
+        for (location_id, region), group in series.groupby(['location_id', 'region']):
+            years, values = group['year'].values, group[pol].values
+            for cutoff in cutoffs:
+                train = values[years < cutoff]
+                test = np.flatnonzero(years >= cutoff)[:horizon]
+                if len(train) >= MIN_TRAIN and len(test):
+                    tasks.append((pol, location_id, region, cutoff, train, years[test], values[test]))
+    return tasks, cutoffs
+
+# ============================
+# Engines: SARIMA per fold on a pool, batch engine for all folds at once
+# ============================
+def _sarima_folds(chunk, order=DEFAULT_ORDER, auto_order=False):
+    """auto_order: order searched on each fold's training years (select_order)"""
+    rows = []
+    for pol, location_id, region, cutoff, train, test_years, actual in chunk:
+        try:
+            res = None
+            if auto_order:
+                order, res = select_order(train)
+            if res is None:
+                res = fit_sarima(train, order=order)
+            preds = np.asarray(res.forecast(steps=len(actual)))
+        except:
+            continue
+        rows += zip([pol] * len(actual), [location_id] * len(actual), [region] * len(actual),
+                    [cutoff] * len(actual), test_years, actual, preds)
+    return rows
+
+
+def run_sarima_folds(tasks, workers=None, chunk_size=8, time_budget=None, order=DEFAULT_ORDER,
+                     auto_order=False):
+    """Fit folds until done or `time_budget` seconds; returns (rows, folds done).
+
+    Tasks are shuffled (fixed seed) so a run cut by the budget still samples
+    every pollutant and region. When the budget ends, queued chunks are
+    cancelled; those the pool already handed to its workers (the running
+    ones plus workers + 1 queued) finish and their folds are counted, so
+    the overshoot is about two chunks: keep chunk_size small.
+    """
+    order = np.random.default_rng(0).permutation(len(tasks))
+    tasks = [tasks[i] for i in order]
+    chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    rows, done_folds = [], 0
+    sarima_folds = partial(_sarima_folds, order=order, auto_order=auto_order)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for chunk in chunks:
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            rows += sarima_folds(chunk)
+            done_folds += len(chunk)
+        return rows, done_folds
+
+    with blas_limited_pool(workers) as executor:
+        pending = {executor.submit(sarima_folds, chunk): len(chunk) for chunk in chunks}
+        while pending:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # cancel() fails only for the chunks a worker already holds
+                running = [future for future in pending if not future.cancel()]
+                print(f"Time budget of {time_budget}s reached, {len(pending) - len(running)} chunks "
+                      f"cancelled, waiting for {len(running)} running")
+                for future in running:
+                    rows += future.result()
+                    done_folds += pending[future]
+                break
+            for future in done:
+                rows += future.result()
+                done_folds += pending.pop(future)
+    return rows, done_folds
+
+
+def run_batch_folds(tasks, method='damped'):
+    """Every fold fitted at once by the vectorized engine"""
+    if not tasks:
+        return [], 0
+    horizon = max(len(t[6]) for t in tasks)
+    Y, lengths = pad_series([t[4] for t in tasks])
+    preds = batch_forecast(Y, lengths, horizon, method)
+    rows = []
+    for (pol, location_id, region, cutoff, _, test_years, actual), p in zip(tasks, preds):
+        k = len(actual)
+        rows += zip([pol] * k, [location_id] * k, [region] * k, [cutoff] * k, test_years, actual, p[:k])
+    return rows, len(tasks)
+
+# ============================
+# Report: MAE / RMSE / MAPE per pollutant and region (+ 'ALL')
+# ============================
+def summarize(rows, coverage):
+    df = pd.DataFrame(rows, columns=['pollutant', 'location_id', 'region', 'cutoff', 'year',
+                                     'actual', 'pred'])
+    df['abs_err'] = (df['pred'] - df['actual']).abs()
+    df['sq_err'] = df['abs_err'] ** 2
+    df['ape'] = (df['abs_err'] / df['actual'].abs()).where(df['actual'] != 0) * 100
+
+    def aggregate(frame, keys):
+        return frame.groupby(keys).agg(
+            n_series=('location_id', 'nunique'),
+            n_points=('abs_err', 'size'),
+            mae=('abs_err', 'mean'),
+            rmse=('sq_err', 'mean'),
+            mape=('ape', 'mean'),
+        ).reset_index()
+
+    report = pd.concat([
+        aggregate(df, ['pollutant', 'region']),
+        aggregate(df.assign(region='ALL'), ['pollutant', 'region']),
+    ], ignore_index=True)
+    report['rmse'] = np.sqrt(report['rmse'])
+    report['coverage'] = coverage
+    return report
+
+
+def write_report(report, run_id, model, folds, horizon):
+    sql = """
+    CREATE TABLE IF NOT EXISTS dw.backtest_report (
+        run_id TEXT,
+        model TEXT,
+        pollutant TEXT,
+        region TEXT,
+        folds TEXT,
+        horizon INT,
+        n_series INT,
+        n_points INT,
+        mae DOUBLE PRECISION,
+        rmse DOUBLE PRECISION,
+        mape DOUBLE PRECISION,
+        coverage DOUBLE PRECISION,
+        PRIMARY KEY (run_id, model, pollutant, region)
+    );
+
+    INSERT INTO dw.backtest_report
+    SELECT :run_id, :model, pollutant, region, :folds, :horizon,
+           n_series, n_points, mae, rmse, mape, coverage
+    FROM temp_backtest
+    ON CONFLICT (run_id, model, pollutant, region) DO NOTHING;
+    """
+    with engine.begin() as conn:
+        copy_to_temp_table(conn, report, 'temp_backtest')
+        conn.execute(text(sql), {'run_id': run_id, 'model': model,
+                                 'folds': ','.join(str(c) for c in folds), 'horizon': horizon})
+
+
+def run(config=None):
+    """Backtest one engine ; config : engine, model ('sarima' or 'batch'), batch_method,
+    order (p, d, q), auto_order, folds, horizon, workers, chunk_size, time_budget, run_id
+    """
+    global engine
+    config = config or {}
+    if config.get('engine') is not None:
+        engine = config['engine']
+
+    horizon = config.get('horizon', 1)
+    tasks, cutoffs = build_folds(read_series(), config.get('folds', 3), horizon)
+    print(f"{len(tasks)} folds over cut-offs {', '.join(str(c) for c in cutoffs)}")
+
+    start = time.time()
+    if config.get('model', 'sarima') == 'batch':
+        model = f"batch:{config.get('batch_method', 'damped')}"
+        rows, done = run_batch_folds(tasks, config.get('batch_method', 'damped'))
+    else:
+        order = tuple(config.get('order') or DEFAULT_ORDER)
+        model = "sarima(auto)" if config.get('auto_order') else f"sarima({','.join(map(str, order))})"
+        rows, done = run_sarima_folds(tasks, config.get('workers'), config.get('chunk_size', 8),
+                                      config.get('time_budget'), order, config.get('auto_order', False))
+    coverage = done / len(tasks) if tasks else 0.0
+    print(f"{model}: {done}/{len(tasks)} folds in {time.time() - start:.1f}s")
+
+    report = summarize(rows, coverage)
+    print(report[report['region'] == 'ALL'].to_string(index=False))
+
+    run_id = config.get('run_id') or time.strftime('%Y%m%dT%H%M%S')
+    write_report(report, run_id, model, cutoffs, horizon)
+    print(f"Report saved to dw.backtest_report (run {run_id})")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rolling-origin backtest of the forecasting engines")
+    parser.add_argument("--engine", choices=['sarima', 'batch'], default='sarima')
+    parser.add_argument("--batch-method", choices=METHODS, default='damped')
+    parser.add_argument("--order", type=lambda s: tuple(int(x) for x in s.split(',')),
+                        default=DEFAULT_ORDER, help="SARIMA order p,d,q (default 1,1,1)")
+    parser.add_argument("--auto-order", action="store_true",
+                        help="select the SARIMA order of each fold (see sarima_pool.select_order)")
+    parser.add_argument("--folds", type=int, default=3, help="number of cut-off years (the last ones)")
+    parser.add_argument("--horizon", type=int, default=1, help="points scored after each cut-off")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: all cores, 1 = no pool)")
+    parser.add_argument("--chunk-size", type=int, default=8, help="folds sent to a worker at a time")
+    parser.add_argument("--time-budget", type=float, default=None,
+                        help="seconds after which pending folds are cancelled")
+    args = parser.parse_args()
+    run({'model': args.engine, 'batch_method': args.batch_method, 'order': args.order,
+         'auto_order': args.auto_order, 'folds': args.folds,
+         'horizon': args.horizon, 'workers': args.workers, 'chunk_size': args.chunk_size,
+         'time_budget': args.time_budget})
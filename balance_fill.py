@@ -0,0 +1,68 @@
+import numpy as np
+
+
+# --------------------------
+# Remplissage cohérent quand il manque UNE seule colonne
+# --------------------------
+def fill_single_missing(df, cols_for_balance, total_col='co2'):
+    """Complète les lignes où exactement une colonne de `cols_for_balance` est manquante.
+
+    Si `total_col` manque, il vaut la somme des sources ; sinon la source
+    manquante vaut `total_col` moins la somme des autres sources.
+    Calcul en colonnes NumPy sur tout le DataFrame (modifie `df` en place).
+    """
+    sources = [c for c in cols_for_balance if c != total_col]
+
+    total = df[total_col].to_numpy(dtype='float64', copy=True)
+    src = df[sources].to_numpy(dtype='float64', copy=True)
+
+    total_missing = np.isnan(total)
+    src_missing = np.isnan(src)
+    single = (total_missing.astype(int) + src_missing.sum(axis=1)) == 1
+
+    # Somme des sources connues (NaN → 0, même ordre d'addition que la boucle)
+    src_sum = np.where(src_missing, 0.0, src).sum(axis=1)
+
+    # Cas 1 : total manquant → somme des sources
+    fill_total = single & total_missing
+    if fill_total.any():
+        total[fill_total] = src_sum[fill_total]
+        df[total_col] = total
+
+    # Cas 2 : une source manquante → total - somme des autres
+    fill_src = single & ~total_missing
+    if fill_src.any():
+        gap = total - src_sum
+        rows, cols = np.nonzero(src_missing & fill_src[:, None])
+        src[rows, cols] = gap[rows]
+        for j, col in enumerate(sources):
+            if src_missing[fill_src, j].any():
+                df[col] = src[:, j]
+
+    return df
+
+
+def fill_single_missing_loop(df, cols_for_balance, total_col='co2'):
+    """Ancienne version ligne par ligne (iterrows), gardée comme référence pour le benchmark"""
+
+    def fill_missing_pollutant(row):
+        values = row[cols_for_balance]
+        missing = values[values.isna()].index
+
+        if len(missing) == 1:
+            miss = missing[0]
+            others = values.drop(miss)
+
+            if miss == total_col:
+                return miss, others.sum()
+            else:
+                return miss, row[total_col] - others[others.index != total_col].sum()
+
+        return None, None
+
+    for idx, row in df.iterrows():
+        missing_col, missing_val = fill_missing_pollutant(row)
+        if missing_col:
+            df.at[idx, missing_col] = missing_val
+
+    return df
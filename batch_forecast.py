@@ -0,0 +1,173 @@
+import numpy as np
+
+# ============================
+# Vectorized forecasting of many short series at once
+# ============================
+# Series are left-aligned in a 2-D array padded with NaN; `lengths` holds
+# the number of observed points of each row.
+METHODS = ['damped', 'holt', 'arima110', 'auto']
+
+ALPHAS = np.array([0.1, 0.3, 0.5, 0.7, 0.9])
+BETAS = np.array([0.05, 0.1, 0.2, 0.3])
+PHIS = np.array([0.8, 0.9, 0.98])
+
+
+def pad_series(series_list):
+    lengths = np.array([len(s) for s in series_list], dtype=int)
+    Y = np.full((len(series_list), max(lengths.max(initial=0), 1)), np.nan)
+    for i, s in enumerate(series_list):
+        Y[i, :len(s)] = s
+    return Y, lengths
+
+
+def _last_values(Y, lengths):
+    return Y[np.arange(len(Y)), np.maximum(lengths - 1, 0)]
+
+
+# ----------------------------
+# Holt linear / damped trend (grid search of the smoothing parameters)
+# ----------------------------
+def _holt_grid(Y, lengths, damped):
+    phis = PHIS if damped else np.array([1.0])
+    alpha, beta, phi = (g.ravel() for g in np.meshgrid(ALPHAS, BETAS, phis, indexing='ij'))
+
+    first = Y[:, 0]
+    slope = np.where(lengths >= 2, Y[:, 1] - Y[:, 0], 0.0) if Y.shape[1] > 1 else np.zeros(len(Y))
+    level = np.repeat(first[:, None], len(alpha), axis=1)
+    trend = np.repeat(slope[:, None], len(alpha), axis=1)
+    sse = np.zeros_like(level)
+
+    for t in range(1, Y.shape[1]):
+        active = (t < lengths)[:, None]
+        y = Y[:, t][:, None]
+        fc = level + phi * trend
+        new_level = alpha * y + (1 - alpha) * fc
+        new_trend = beta * (new_level - level) + (1 - beta) * phi * trend
+        sse = np.where(active, sse + (y - fc) ** 2, sse)
+        level = np.where(active, new_level, level)
+        trend = np.where(active, new_trend, trend)
+
+    best = np.argmin(sse, axis=1)
+    rows = np.arange(len(Y))
+    mse = sse[rows, best] / np.maximum(lengths - 1, 1)
+    return level[rows, best], trend[rows, best], phi[best], mse
+
+
+def _holt_forecast(level, trend, phi, steps):
+    # level + (phi + phi² + ... + phi^h) * trend
+    damping = np.cumsum(phi[:, None] ** np.arange(1, steps + 1), axis=1)
+    return level[:, None] + damping * trend[:, None]
+
+
+def holt_forecast(Y, lengths, steps, damped=True):
+    level, trend, phi, mse = _holt_grid(Y, lengths, damped)
+    return _holt_forecast(level, trend, phi, steps), mse
+
+
+# ----------------------------
+# ARIMA(1,1,0) with drift, closed-form least squares on the differences
+# ----------------------------
+def arima110_forecast(Y, lengths, steps):
+    D = np.diff(Y, axis=1)
+    if D.shape[1] == 0:
+        D = np.full((len(Y), 1), np.nan)
+    x, z = D[:, :-1], D[:, 1:]
+    valid = ~np.isnan(x) & ~np.isnan(z)
+    m = valid.sum(axis=1)
+    x0, z0 = np.where(valid, x, 0.0), np.where(valid, z, 0.0)
+
+    mx = x0.sum(axis=1) / np.maximum(m, 1)
+    mz = z0.sum(axis=1) / np.maximum(m, 1)
+    sxx = np.where(valid, (x0 - mx[:, None]) ** 2, 0.0).sum(axis=1)
+    sxz = np.where(valid, (x0 - mx[:, None]) * (z0 - mz[:, None]), 0.0).sum(axis=1)
+    a = np.where(sxx > 0, sxz / np.where(sxx > 0, sxx, 1.0), 0.0)
+
+    # Fewer than two usable pairs: random walk with drift = mean difference
+    d_valid = ~np.isnan(D)
+    drift = np.where(d_valid, D, 0.0).sum(axis=1) / np.maximum(d_valid.sum(axis=1), 1)
+    a = np.where(m >= 2, a, 0.0)
+    c = np.where(m >= 2, mz - a * mx, drift)
+
+    resid = np.where(valid, z0 - (c[:, None] + a[:, None] * x0), 0.0)
+    mse = np.where(m > 0, (resid ** 2).sum(axis=1) / np.maximum(m, 1), np.inf)
+
+    last_d = np.where(lengths >= 2, D[np.arange(len(Y)), np.maximum(lengths - 2, 0)], 0.0)
+    last_d = np.nan_to_num(last_d)
+    y = _last_values(Y, lengths)
+    preds = np.empty((len(Y), steps))
+    for h in range(steps):
+        last_d = c + a * last_d
+        y = y + last_d
+        preds[:, h] = y
+    return preds, mse
+
+
+def _held_out_error(Y, lengths, forecaster):
+    """|error| of the one-step forecast of each row's last point, fitted without it"""
+    rows = np.arange(len(Y))
+    Y_train = Y.copy()
+    Y_train[rows, np.maximum(lengths - 1, 0)] = np.nan
+    error = np.abs(_last_values(Y, lengths) - forecaster(Y_train, lengths - 1, 1)[:, 0])
+    return np.nan_to_num(error, nan=np.inf)
+
+
+AUTO_CANDIDATES = [
+    lambda Y, lengths, steps: holt_forecast(Y, lengths, steps, damped=True)[0],
+    lambda Y, lengths, steps: holt_forecast(Y, lengths, steps, damped=False)[0],
+    lambda Y, lengths, steps: arima110_forecast(Y, lengths, steps)[0],
+]
+AUTO_MIN_LENGTH = 4  # shorter series keep the damped trend
+
+
+def batch_forecast(Y, lengths, steps, method='damped'):
+    """Forecasts (n, steps) for every row of Y"""
+    if method == 'damped':
+        return holt_forecast(Y, lengths, steps, damped=True)[0]
+    if method == 'holt':
+        return holt_forecast(Y, lengths, steps, damped=False)[0]
+    if method == 'arima110':
+        return arima110_forecast(Y, lengths, steps)[0]
+    if method == 'auto':
+        # Per series, the model with the lowest error on the held-out last point
+        # (the in-sample MSE does not penalize the free parameters of each model)
+        errors = np.stack([_held_out_error(Y, lengths, f) for f in AUTO_CANDIDATES])
+        best = np.where(lengths >= AUTO_MIN_LENGTH, np.argmin(errors, axis=0), 0)
+        preds = np.stack([f(Y, lengths, steps) for f in AUTO_CANDIDATES])
+        return preds[best, np.arange(len(Y))]
+    raise ValueError(f"Unknown batch method {method!r}, expected one of {METHODS}")
+
+
+def batch_evaluate_and_forecast(series_list, steps, method='damped', min_eval_length=5):
+    """Same contract as sarima_pool.evaluate_and_forecast, for all series at once.
+
+    Evaluation: fit on all but the last point of each series (of at least
+    `min_eval_length` points) and score the one-step forecast of that point.
+    Returns [(eval_res, preds), ...] in input order.
+    """
+    if not series_list:
+        return []
+    Y, lengths = pad_series(series_list)
+    rows = np.arange(len(Y))
+
+    preds = batch_forecast(Y, lengths, steps, method)
+
+    held_out = _last_values(Y, lengths)
+    Y_train = Y.copy()
+    Y_train[rows, lengths - 1] = np.nan
+    errors = np.abs(held_out - batch_forecast(Y_train, lengths - 1, 1, method)[:, 0])
+
+    results = []
+    for i in rows:
+        eval_res = None
+        if lengths[i] >= min_eval_length:
+            eval_res = {"mae": errors[i], "rmse": np.sqrt(errors[i] ** 2), "r2": None}
+        results.append((eval_res, preds[i].tolist()))
+    return results
+
+
+def run_batch_tasks(tasks, start_year, end_year, method='damped'):
+    """Same tasks/results as sarima_pool.run_sarima_tasks, fitted by the batch engine (no params kept)"""
+    steps = end_year - start_year + 1
+    fitted = batch_evaluate_and_forecast([values for _, _, _, values in tasks], steps, method)
+    return [(pollutant, location_id, eval_res, preds, None, None)
+            for (pollutant, location_id, _, _), (eval_res, preds) in zip(tasks, fitted)]
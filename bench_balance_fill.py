@@ -0,0 +1,47 @@
+import time
+import numpy as np
+import pandas as pd
+from balance_fill import fill_single_missing, fill_single_missing_loop
+
+# --------------------------
+# Benchmark : remplissage vectorisé vs boucle iterrows
+# --------------------------
+cols_for_balance = [
+    'co2','cement_co2','coal_co2','flaring_co2',
+    'gas_co2','oil_co2','other_industry_co2'
+]
+
+
+def make_frame(n_rows, seed=0):
+    """Jeu de données synthétique au format OWID (quelques NaN par ligne)"""
+    rng = np.random.default_rng(seed)
+    sources = rng.uniform(0, 100, size=(n_rows, len(cols_for_balance) - 1))
+    df = pd.DataFrame(sources, columns=cols_for_balance[1:])
+    df.insert(0, 'co2', sources.sum(axis=1))
+    df['country'] = rng.choice(['France', 'Tunisia', 'Chile', 'India'], size=n_rows)
+    df['year'] = rng.integers(1981, 2024, size=n_rows)
+
+    # 0, 1 ou 2 valeurs manquantes par ligne
+    for k in range(2):
+        rows = rng.random(n_rows) < 0.3
+        cols = rng.integers(0, len(cols_for_balance), size=n_rows)
+        for j, col in enumerate(cols_for_balance):
+            df.loc[rows & (cols == j), col] = np.nan
+    return df
+
+
+if __name__ == "__main__":
+    for n_rows in [1_000, 10_000]:
+        df = make_frame(n_rows)
+
+        t0 = time.perf_counter()
+        expected = fill_single_missing_loop(df.copy(), cols_for_balance)
+        t_loop = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        result = fill_single_missing(df.copy(), cols_for_balance)
+        t_vec = time.perf_counter() - t0
+
+        pd.testing.assert_frame_equal(result, expected)
+        print(f"{n_rows:>7} lignes : boucle {t_loop:.3f}s | vectorisé {t_vec:.4f}s "
+              f"| x{t_loop / t_vec:.0f}")
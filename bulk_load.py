@@ -0,0 +1,68 @@
+import io
+import pandas as pd
+
+# --------------------------
+# Chargement en masse via COPY ... FROM STDIN
+# --------------------------
+NULL_MARKER = r'\N'
+
+
+def infer_pg_types(df, overrides=None):
+    """Type PostgreSQL de chaque colonne à partir du dtype pandas"""
+    types = {}
+    for col, dtype in df.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype):
+            types[col] = 'boolean'
+        elif pd.api.types.is_integer_dtype(dtype):
+            types[col] = 'bigint'
+        elif pd.api.types.is_float_dtype(dtype):
+            types[col] = 'double precision'
+        else:
+            types[col] = 'text'
+    types.update(overrides or {})
+    return types
+
+
+def _copy(cursor, sql, buf):
+    """COPY compatible psycopg2 (copy_expert) et psycopg 3 (cursor.copy)"""
+    if hasattr(cursor, 'copy_expert'):
+        cursor.copy_expert(sql, buf)
+    else:
+        with cursor.copy(sql) as copy:
+            copy.write(buf.getvalue())
+
+
+def copy_to_temp_table(conn, df, temp_table, column_types=None, chunk_rows=50_000):
+    """Crée une table TEMPORARY typée et y streame `df` par COPY (format CSV).
+
+    La table est propre à la session et supprimée au COMMIT : à appeler dans
+    le même `engine.begin()` que l'UPSERT qui la lit.
+    Les chaînes vides restent des chaînes vides (NULL = '\\N').
+    """
+    types = infer_pg_types(df, column_types)
+    cols = list(df.columns)
+    col_defs = ', '.join(f'"{c}" {types[c]}' for c in cols)
+    col_list = ', '.join(f'"{c}"' for c in cols)
+
+    dbapi_conn = conn.connection
+    cursor = dbapi_conn.cursor()
+    try:
+        cursor.execute(f"DROP TABLE IF EXISTS pg_temp.{temp_table}")
+        cursor.execute(f"CREATE TEMPORARY TABLE {temp_table} ({col_defs}) ON COMMIT DROP")
+
+        copy_sql = (
+            f"COPY {temp_table} ({col_list}) FROM STDIN "
+            f"WITH (FORMAT csv, NULL '{NULL_MARKER}')"
+        )
+        # Par blocs pour ne jamais matérialiser tout le CSV en mémoire
+        for start in range(0, len(df), chunk_rows):
+            buf = io.StringIO()
+            df.iloc[start:start + chunk_rows].to_csv(
+                buf, index=False, header=False, na_rep=NULL_MARKER
+            )
+            buf.seek(0)
+            _copy(cursor, copy_sql, buf)
+    finally:
+        cursor.close()
+
+    return len(df)
@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+
+# --------------------------
+# Configuration PostgreSQL et engine partagé (un pool par processus)
+# --------------------------
+# Valeurs par défaut, surchargées par le fichier JSON (DWH_CONFIG, sinon
+# db_config.json) puis par les variables d'environnement DWH_<CLE>.
+DEFAULTS = {
+    'user': 'myuser',
+    'password': 'strong_password',
+    'host': 'localhost',
+    'port': 5432,
+    'database': 'dwh_pollution',
+    'pool_size': 5,
+    'max_overflow': 5,
+    'pool_recycle': 1800,
+    'statement_timeout_ms': 600_000,
+    'application_name': 'green_up',
+}
+
+CONFIG_FILE = "db_config.json"
+
+_engine = None
+_lock = threading.Lock()
+_stage = threading.local()
+
+
+def load_config():
+    config = dict(DEFAULTS)
+    path = os.environ.get('DWH_CONFIG', CONFIG_FILE)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            config.update(json.load(f))
+
+    for key, default in DEFAULTS.items():
+        value = os.environ.get(f"DWH_{key.upper()}")
+        if value is not None:
+            config[key] = type(default)(value)
+    return config
+
+
+def set_stage(name):
+    """Étiquette (application_name) des connexions prises par ce thread"""
+    _stage.name = name
+
+
+def current_stage():
+    return getattr(_stage, 'name', None)
+
+
+def _tag_connection(dbapi_conn, record, proxy):
+    """À chaque checkout, aligne application_name sur l'étape courante (si elle a changé)"""
+    name = current_stage() or record.info.get('default_name')
+    if name and record.info.get('application_name') != name:
+        cursor = dbapi_conn.cursor()
+        cursor.execute("SELECT set_config('application_name', %s, false)", (name,))
+        cursor.close()
+        # psycopg2 a ouvert une transaction : sans commit, le rollback du pool annulerait le SET
+        dbapi_conn.commit()
+        record.info['application_name'] = name
+
+
+def _create_engine(config):
+    from sqlalchemy import create_engine, event
+
+    url = (f"postgresql://{config['user']}:{config['password']}"
+           f"@{config['host']}:{config['port']}/{config['database']}")
+    default_name = config['application_name']
+    engine = create_engine(
+        url,
+        pool_size=config['pool_size'],
+        max_overflow=config['max_overflow'],
+        pool_recycle=config['pool_recycle'],
+        pool_pre_ping=True,
+        connect_args={
+            'application_name': default_name,
+            'options': f"-c statement_timeout={config['statement_timeout_ms']}",
+        },
+    )
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, record):
+        record.info['default_name'] = default_name
+        record.info['application_name'] = default_name
+
+    event.listen(engine, "checkout", _tag_connection)
+    return engine
+
+
+def get_engine(stage=None):
+    """Engine du processus, créé au premier appel ; `stage` étiquette le thread appelant"""
+    global _engine
+    if stage is not None:
+        set_stage(stage)
+    with _lock:
+        if _engine is None:
+            _engine = _create_engine(load_config())
+    return _engine
@@ -0,0 +1,51 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# --------------------------
+# Empreinte d'un DataFrame sans passer par to_csv
+# --------------------------
+def column_digests(df):
+    """Digest md5 de chaque colonne, calculé sur les buffers hashés par pandas.
+
+    hash_pandas_object (clé fixe) donne un uint64 par valeur, indépendant de
+    l'index ; on le replie dans un md5 sans construire de texte intermédiaire.
+    """
+    digests = {}
+    for col in df.columns:
+        values = pd.util.hash_pandas_object(df[col], index=False).to_numpy()
+        h = hashlib.md5()
+        h.update(np.ascontiguousarray(values, dtype='<u8').data)
+        digests[str(col)] = h.hexdigest()
+    return digests
+
+
+def dataset_fingerprint(df, digests=None):
+    """Empreinte globale : noms de colonnes, nombre de lignes et digests par colonne"""
+    if digests is None:
+        digests = column_digests(df)
+    h = hashlib.md5()
+    h.update(str(len(df)).encode())
+    for col, digest in digests.items():
+        h.update(b'\0' + col.encode('utf-8') + b'\0' + digest.encode())
+    return h.hexdigest()
+
+
+def changed_columns(previous, current):
+    """Colonnes ajoutées, supprimées ou dont le contenu a changé"""
+    cols = list(current) + [c for c in previous if c not in current]
+    return [c for c in cols if previous.get(c) != current.get(c)]
+
+
+def load_column_digests(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_column_digests(path, digests):
+    with open(path, "w", encoding='utf-8') as f:
+        json.dump(digests, f, indent=1)
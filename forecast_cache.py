@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import sqlite3
+import numpy as np
+
+# ============================
+# Persistent forecast cache (SQLite), one row per (location, pollutant, model spec)
+# ============================
+CACHE_FILE = os.path.join("cache", "forecasts.sqlite")
+
+
+def series_digest(years, values):
+    """md5 of the (year, value) series as int64 / float64 buffers"""
+    h = hashlib.md5()
+    h.update(np.asarray(years, dtype='int64').tobytes())
+    h.update(np.asarray(values, dtype='float64').tobytes())
+    return h.hexdigest()
+
+
+def open_cache(path=CACHE_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS forecasts (
+        location_id INTEGER,
+        pollutant TEXT,
+        spec TEXT,
+        digest TEXT,
+        params TEXT,
+        eval_res TEXT,
+        preds TEXT,
+        PRIMARY KEY (location_id, pollutant, spec)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS orders (
+        location_id INTEGER,
+        pollutant TEXT,
+        p INTEGER,
+        d INTEGER,
+        q INTEGER,
+        PRIMARY KEY (location_id, pollutant)
+    )
+    """)
+    return conn
+
+
+def _to_json(value):
+    return json.dumps(value, default=float)
+
+
+def split_cached(conn, tasks, spec):
+    """Cached results of the tasks whose series digest is unchanged, and the tasks to refit.
+
+    Returns ({(pollutant, location_id): result}, [tasks to fit]).
+    """
+    stored = {
+        (pollutant, location_id): (digest, params, eval_res, preds)
+        for location_id, pollutant, digest, params, eval_res, preds in conn.execute(
+            "SELECT location_id, pollutant, digest, params, eval_res, preds FROM forecasts WHERE spec = ?",
+            (spec,)
+        )
+    }
+    hits, misses = {}, []
+    for task in tasks:
+        pollutant, location_id, years, values = task
+        row = stored.get((pollutant, int(location_id)))
+        if row is not None and row[0] == series_digest(years, values):
+            _, params, eval_res, preds = row
+            hits[(pollutant, location_id)] = (pollutant, location_id, json.loads(eval_res),
+                                              json.loads(preds), json.loads(params), None)
+        else:
+            misses.append(task)
+    return hits, misses
+
+
+def store_results(conn, tasks, results, spec):
+    """Save the results of `tasks` (same order) under their current series digest"""
+    rows = [
+        (int(location_id), pollutant, spec, series_digest(years, values),
+         _to_json(params), _to_json(eval_res), _to_json(preds))
+        for (pollutant, location_id, years, values), (_, _, eval_res, preds, params, _) in zip(tasks, results)
+    ]
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO forecasts VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def previous_params(conn):
+    """{(pollutant, location_id): params} of the last fit of each series, whatever its spec"""
+    return {
+        (pollutant, location_id): json.loads(params)
+        for location_id, pollutant, params in conn.execute(
+            "SELECT location_id, pollutant, params FROM forecasts WHERE params <> 'null' ORDER BY rowid"
+        )
+    }
+
+
+def cached_orders(conn):
+    """{(pollutant, location_id): (p, d, q)} chosen by earlier order searches"""
+    return {
+        (pollutant, location_id): (p, d, q)
+        for location_id, pollutant, p, d, q in conn.execute(
+            "SELECT location_id, pollutant, p, d, q FROM orders"
+        )
+    }
+
+
+def store_orders(conn, results):
+    """Save the orders selected during this run (fit_info['selected'])"""
+    rows = [
+        (int(location_id), pollutant, *info['order'])
+        for pollutant, location_id, _, _, _, info in results
+        if info is not None and info.get('selected')
+    ]
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?)", rows)
+    return len(rows)
+
+
+def evict_missing_locations(conn, location_ids):
+    """Drop the entries of locations no longer in dw.dim_location ; returns the count"""
+    with conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS live_location (location_id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM live_location")
+        conn.executemany("INSERT OR IGNORE INTO live_location VALUES (?)",
+                         [(int(i),) for i in location_ids])
+        cursor = conn.execute(
+            "DELETE FROM forecasts WHERE location_id NOT IN (SELECT location_id FROM live_location)"
+        )
+        conn.execute("DELETE FROM orders WHERE location_id NOT IN (SELECT location_id FROM live_location)")
+    return cursor.rowcount
@@ -0,0 +1,34 @@
+# --------------------------
+# Imputation hiérarchique par moyennes de groupes
+# --------------------------
+def impute_by_levels(df, levels, cols):
+    """Remplit les NaN de `cols` par la moyenne du groupe, niveau par niveau.
+
+    `levels` va du plus fin au plus large, ex. [['city','year'], ['city'], ['country']].
+    Chaque niveau calcule toutes les moyennes en un seul groupby natif ;
+    les lignes dont la clé de groupe est NaN gardent leur valeur.
+    Modifie `df` en place et renvoie le nombre de cellules remplies par niveau.
+    """
+    cols = [c for c in cols if c in df.columns]
+    report = {}
+
+    for keys in levels:
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        name = '/'.join(keys)
+
+        todo = [c for c in cols if df[c].isna().any()]
+        if not todo:
+            report[name] = 0
+            continue
+
+        before = df[todo].isna().sum().sum()
+        means = df.groupby(keys, sort=False)[todo].transform('mean')
+        df[todo] = df[todo].fillna(means)
+        report[name] = int(before - df[todo].isna().sum().sum())
+
+    return report
+
+
+def format_report(report):
+    """Résumé lisible : 'city: 12, country: 3'"""
+    return ', '.join(f"{name}: {n}" for name, n in report.items())
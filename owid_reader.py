@@ -0,0 +1,30 @@
+import pandas as pd
+
+# --------------------------
+# Lecture projetée, typée et par blocs des CSV OWID
+# --------------------------
+TEXT_COLUMNS = ['country', 'iso_code']
+
+
+def read_owid_csv(path, columns, min_year=None, chunksize=200_000, engine=None):
+    """Lit seulement `columns` (celles absentes du fichier sont ignorées).
+
+    Dtypes explicites : year en int64, valeurs en float64, texte inféré comme
+    d'habitude. Les lignes avec year <= min_year sont écartées bloc par bloc
+    pendant la lecture ; engine='pyarrow' lit le fichier projeté d'un coup
+    (multi-thread) puis filtre. L'index d'origine des lignes gardées est conservé.
+    """
+    wanted = set(columns) | {'year'}
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [c for c in header if c in wanted]
+    dtypes = {c: 'float64' for c in usecols if c not in TEXT_COLUMNS}
+    dtypes['year'] = 'int64'
+
+    def keep(chunk):
+        return chunk if min_year is None else chunk[chunk['year'] > min_year]
+
+    if engine == 'pyarrow':
+        return keep(pd.read_csv(path, usecols=usecols, dtype=dtypes, engine='pyarrow'))
+
+    reader = pd.read_csv(path, usecols=usecols, dtype=dtypes, chunksize=chunksize)
+    return pd.concat([keep(chunk) for chunk in reader])
@@ -0,0 +1,158 @@
+import importlib
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from source_check import SKIPPED_EXIT_CODE, OK, SKIPPED
+from db import set_stage
+
+# --------------------------
+# Ordonnanceur d'étapes (DAG) exécutées en parallèle
+# --------------------------
+# func(*args) s'exécute dans un thread du pool et renvoie OK ou SKIPPED
+Stage = namedtuple('Stage', ['name', 'func', 'args', 'deps'])
+
+FAILED, CANCELLED = 'failed', 'cancelled'
+
+# Scripts en cours (run_script) -> arrêtés par l'ordonnanceur ?
+_children = {}
+_children_lock = threading.Lock()
+
+
+class StageCancelled(Exception):
+    """Étape arrêtée par l'ordonnanceur après l'échec d'une autre"""
+
+
+def run_script(script, *extra_args):
+    """Lance un script Python dans un interpréteur séparé (arrêtable par terminate_scripts)"""
+    args = [sys.executable, script, *extra_args]
+    proc = subprocess.Popen(args)
+    with _children_lock:
+        _children[proc] = False
+    try:
+        returncode = proc.wait()
+    finally:
+        with _children_lock:
+            stopped = _children.pop(proc)
+    if stopped:
+        raise StageCancelled(script)
+    if returncode == SKIPPED_EXIT_CODE:
+        return SKIPPED
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args)
+    return OK
+
+
+def terminate_scripts(grace=10):
+    """terminate() des scripts encore en cours, kill() de ceux toujours vivants après `grace` secondes"""
+    with _children_lock:
+        procs = list(_children)
+        for proc in procs:
+            _children[proc] = True
+    for proc in procs:
+        proc.terminate()
+    deadline = time.monotonic() + grace
+    for proc in procs:
+        try:
+            proc.wait(timeout=max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def run_module(module_name, config):
+    """Exécute module.run(config) dans le processus courant (imports et engine partagés)"""
+    # Connexions de ce thread étiquetées au nom de l'étape (pg_stat_activity)
+    set_stage(module_name)
+    module = importlib.import_module(module_name)
+    return module.run(config)
+
+
+def _timed(func, args):
+    start = time.time()
+    status = func(*args)
+    return status or OK, start, time.time() - start
+
+
+def _check_dag(stages):
+    names = {s.name for s in stages}
+    for s in stages:
+        missing = set(s.deps) - names
+        if missing:
+            raise ValueError(f"Étape {s.name} : dépendances inconnues {sorted(missing)}")
+
+    # Détection de cycle (tri topologique)
+    remaining = {s.name: set(s.deps) for s in stages}
+    while remaining:
+        ready = [n for n, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"Cycle dans les dépendances : {sorted(remaining)}")
+        for n in ready:
+            del remaining[n]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+
+def run_pipeline(stages, max_workers=None):
+    """Exécute les étapes dès que leurs dépendances sont terminées.
+
+    Chaque étape tourne dans un thread : run_script y attend son processus
+    enfant, run_module y exécute le module (imports et engine partagés).
+    Au premier échec, plus aucune étape ne démarre, celles en attente sont
+    annulées et les scripts encore en cours arrêtés (CANCELLED) ; une étape
+    run_module ne peut pas être interrompue et va jusqu'au bout.
+    Renvoie {nom: (statut, début, durée, erreur)}.
+    """
+    _check_dag(stages)
+    max_workers = max_workers or os.cpu_count() or 1
+    results = {}
+    waiting = list(stages)
+    running = {}
+    failed = False
+    t0 = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while waiting or running:
+            if not failed:
+                for stage in list(waiting):
+                    # Ne soumettre que ce qui peut démarrer tout de suite
+                    if len(running) >= max_workers:
+                        break
+                    if all(results.get(d, (None,))[0] in (OK, SKIPPED) for d in stage.deps):
+                        print(f"🔹 Démarrage de {stage.name} ...")
+                        future = executor.submit(_timed, stage.func, stage.args)
+                        running[future] = stage
+                        waiting.remove(stage)
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    status, start, elapsed = future.result()
+                    results[stage.name] = (status, start - t0, elapsed, None)
+                except StageCancelled:
+                    results[stage.name] = (CANCELLED, None, None, None)
+                except Exception as e:
+                    results[stage.name] = (FAILED, None, None, e)
+                    print(f" Échec de {stage.name} : {e}")
+                    if not failed:
+                        failed = True
+                        if running:
+                            print(f" Arrêt des étapes en cours : {', '.join(s.name for s in running.values())}")
+                        terminate_scripts()
+
+    for stage in waiting:
+        results[stage.name] = (CANCELLED, None, None, None)
+    return results
+
+
+def print_summary(results):
+    print("\n=== Résumé des étapes ===")
+    for name, (status, start, elapsed, _) in results.items():
+        timing = f"début +{start:6.1f}s  durée {elapsed:6.1f}s" if elapsed is not None else ""
+        print(f"  {name:<12} {status:<10} {timing}".rstrip())
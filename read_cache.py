@@ -0,0 +1,98 @@
+import os
+import re
+import pandas as pd
+from source_check import file_digest
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow absent : lecture Excel directe, sans cache
+    pq = None
+
+# --------------------------
+# Cache Parquet des feuilles Excel (lecture colonne par colonne)
+# --------------------------
+CACHE_DIR = "cache"
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+
+def _slug(value):
+    return re.sub(r'[^A-Za-z0-9]+', '_', str(value)).strip('_')
+
+
+def _cache_prefix(path, sheet_name):
+    return f"{_slug(os.path.basename(path))}__{_slug(sheet_name)}__"
+
+
+def _arrow_safe(df):
+    """Colonnes objet à types mélangés (int + texte...) → texte, NaN conservés.
+
+    Le nettoyage applique ensuite astype(str) ou to_numeric, donc le
+    résultat est identique à la lecture Excel directe.
+    """
+    df = df.copy()
+    df.columns = [str(c) for c in df.columns]
+    for col in df.columns:
+        if df[col].dtype == object:
+            types = {type(v) for v in df[col].dropna()}
+            if len(types) > 1:
+                df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+def _select(columns, usecols):
+    if usecols is None:
+        return None
+    if callable(usecols):
+        return [c for c in columns if usecols(c)]
+    return [c for c in columns if c in set(usecols)]
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, keep=()):
+    """Supprime les fichiers les plus anciens tant que le cache dépasse max_bytes"""
+    if not os.path.isdir(cache_dir):
+        return
+    files = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir) if f.endswith('.parquet')]
+    files.sort(key=os.path.getmtime)
+    total = sum(os.path.getsize(f) for f in files)
+    for f in files:
+        if total <= max_bytes:
+            break
+        if f in keep:
+            continue
+        total -= os.path.getsize(f)
+        os.remove(f)
+
+
+def read_excel_cached(path, sheet_name=0, usecols=None, cache_dir=CACHE_DIR,
+                      max_bytes=MAX_CACHE_BYTES, **read_kwargs):
+    """pd.read_excel avec cache Parquet, clé = digest du fichier + nom de feuille.
+
+    `usecols` (liste ou fonction nom → bool) limite les colonnes lues.
+    Les versions périmées d'une même feuille sont supprimées à l'écriture.
+    """
+    if pq is None:
+        df = pd.read_excel(path, sheet_name=sheet_name, **read_kwargs)
+        cols = _select(df.columns, usecols)
+        return df if cols is None else df[cols]
+
+    prefix = _cache_prefix(path, sheet_name)
+    cache_file = os.path.join(cache_dir, f"{prefix}{file_digest(path)[:16]}.parquet")
+
+    if not os.path.exists(cache_file):
+        df = _arrow_safe(pd.read_excel(path, sheet_name=sheet_name, **read_kwargs))
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        df.to_parquet(tmp_file, index=False, compression='zstd')
+        os.replace(tmp_file, cache_file)
+
+        # Anciennes versions de la même feuille
+        for f in os.listdir(cache_dir):
+            stale = os.path.join(cache_dir, f)
+            if f.startswith(prefix) and stale != cache_file:
+                os.remove(stale)
+        evict(cache_dir, max_bytes, keep=(cache_file,))
+    else:
+        os.utime(cache_file)  # récemment utilisé → évincé en dernier
+
+    cols = _select(pq.read_schema(cache_file).names, usecols)
+    return pd.read_parquet(cache_file, columns=cols, memory_map=True)
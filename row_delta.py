@@ -0,0 +1,69 @@
+import os
+import pandas as pd
+from sqlalchemy import text
+from bulk_load import copy_to_temp_table
+
+# --------------------------
+# Détection des changements ligne par ligne (clé naturelle → empreinte)
+# --------------------------
+def row_hashes(df, key_cols):
+    """Empreinte 64 bits de chaque ligne (colonnes hors clé), stable d'un run à l'autre"""
+    value_cols = [c for c in df.columns if c not in key_cols]
+    hashes = pd.util.hash_pandas_object(df[value_cols], index=False)
+    return hashes.astype('uint64').astype(str).to_numpy()
+
+
+def key_frame(df, key_cols):
+    """Clés naturelles en texte, pour comparer avec l'état relu du fichier"""
+    return df[key_cols].astype(str).reset_index(drop=True)
+
+
+def load_row_state(state_file, key_cols):
+    """État précédent : une ligne par clé avec sa colonne row_hash"""
+    if not os.path.exists(state_file):
+        return pd.DataFrame(columns=key_cols + ['row_hash'], dtype=str)
+    return pd.read_csv(state_file, dtype=str, keep_default_na=False)
+
+
+def save_row_state(state_file, state):
+    state.to_csv(state_file, index=False, encoding='utf-8')
+
+
+def compute_delta(df, key_cols, previous_state):
+    """Compare `df` à l'état précédent.
+
+    Renvoie (lignes insérées ou modifiées, clés supprimées, nouvel état).
+    """
+    state = key_frame(df, key_cols)
+    state['row_hash'] = row_hashes(df, key_cols)
+
+    merged = state.merge(
+        previous_state[key_cols + ['row_hash']], on=key_cols, how='outer',
+        suffixes=('', '_prev'), indicator=True
+    )
+    changed = merged.loc[
+        (merged['_merge'] == 'left_only') |
+        ((merged['_merge'] == 'both') & (merged['row_hash'] != merged['row_hash_prev'])),
+        key_cols
+    ]
+    deleted = merged.loc[merged['_merge'] == 'right_only', key_cols].reset_index(drop=True)
+
+    # Retrouver les lignes d'origine (dtypes intacts) des clés modifiées
+    is_changed = state[key_cols].merge(changed, on=key_cols, how='left', indicator=True)['_merge'] == 'both'
+    changed_rows = df[is_changed.to_numpy()]
+
+    return changed_rows, deleted, state
+
+
+def delete_keys(engine, keys, table_name, key_cols, schema='etl'):
+    """Supprime de schema.table les clés disparues de la source"""
+    if keys.empty:
+        return 0
+    temp_table = f"temp_del_{table_name}"
+    condition = ' AND '.join(f"s.{c}::text = d.{c}" for c in key_cols)
+    with engine.begin() as conn:
+        copy_to_temp_table(conn, keys, temp_table, {c: 'text' for c in key_cols})
+        result = conn.execute(text(
+            f"DELETE FROM {schema}.{table_name} s USING {temp_table} d WHERE {condition}"
+        ))
+    return result.rowcount
@@ -1,19 +1,48 @@
-import subprocess
+import argparse
 import sys
+from pipeline import Stage, run_pipeline, run_script, run_module, print_summary, FAILED, CANCELLED
 
-print("=== Démarrage de l'ETL complet ===")
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    parser = argparse.ArgumentParser(description="ETL complet : stagings puis load DW")
+    parser.add_argument("--jobs", type=int, default=3, help="nombre max d'étapes en parallèle")
+    parser.add_argument("--force", action="store_true", help="ignorer la vérification des sources")
+    parser.add_argument("--full", action="store_true",
+                        help="recharger tout le DW (ignorer les high-water marks de load_dw)")
+    parser.add_argument("--parallel-facts", action="store_true",
+                        help="charger les tables de faits du DW en parallèle (commit à deux phases)")
+    parser.add_argument("--in-process", action="store_true",
+                        help="exécuter les étapes dans ce processus (imports et engine partagés)")
+    args = parser.parse_args()
 
-# 1️⃣ Exécution des stagings (hash + UPSERT déjà gérés dans chaque staging)
-staging_scripts = ["staging_d1.py", "staging_d2.py", "staging_d3.py"]
+    print("=== Démarrage de l'ETL complet ===")
 
-for script in staging_scripts:
-    print(f"🔹 Exécution de {script} ...")
-    subprocess.run([sys.executable, script], check=True)  # Utilise la même version de python
+    stagings = ["staging_d1", "staging_d2", "staging_d3"]
+    deps_dw = tuple(stagings)
 
-print(" Tous les stagings terminés")
+    if args.in_process:
+        # Un seul engine (et pool de connexions) pour toutes les étapes
+        from db import get_engine
+        engine = get_engine('run_etl')
+        config = {"engine": engine, "force": args.force, "full": args.full,
+                  "parallel_facts": args.parallel_facts}
+        stages = [Stage(name, run_module, (name, config), ()) for name in stagings]
+        stages.append(Stage("load_dw", run_module, ("load_dw", config), deps_dw))
+    else:
+        # 1️⃣ Stagings indépendants (hash + UPSERT déjà gérés dans chaque staging)
+        # --force transmis aux stagings pour ignorer la vérification des sources
+        extra = ("--force",) if args.force else ()
+        stages = [Stage(name, run_script, (f"{name}.py", *extra), ()) for name in stagings]
 
-# 2️⃣ Chargement dans le Data Warehouse
-print(" Exécution du load DW ...")
-subprocess.run([sys.executable, "load_dw.py"], check=True)
+        # 2️⃣ Chargement dans le Data Warehouse, une fois tous les stagings terminés
+        extra_dw = (("--full",) if args.full else ()) + (("--parallel-facts",) if args.parallel_facts else ())
+        stages.append(Stage("load_dw", run_script, ("load_dw.py", *extra_dw), deps_dw))
 
-print("=== ETL complet terminé avec succès ===")
+    results = run_pipeline(stages, max_workers=args.jobs)
+    print_summary(results)
+
+    if any(r[0] in (FAILED, CANCELLED) for r in results.values()):
+        print("=== ETL interrompu ===")
+        sys.exit(1)
+
+    print("=== ETL complet terminé avec succès ===")
@@ -0,0 +1,223 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+import numpy as np
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+from statsmodels.tsa.arima.estimators.hannan_rissanen import hannan_rissanen
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # no threadpoolctl: rely on the BLAS env variables only
+    threadpool_limits = None
+
+# ============================
+# Parallel SARIMA fitting over (location, pollutant) series
+# ============================
+# Read by OpenBLAS / MKL / Accelerate when a worker process loads numpy
+BLAS_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+DEFAULT_ORDER = (1, 1, 1)  # simple but robust
+# Auto-order candidates: d stays 1 (AIC is not comparable across differencing orders)
+ORDER_GRID = [(p, 1, q) for p in (0, 1, 2) for q in (0, 1, 2)]
+
+
+def fit_sarima(history, start_params=None, info=None, order=DEFAULT_ORDER):
+    """Fit from `start_params` when given, cold start if that fails or does not converge.
+
+    `info` accumulates optimizer iterations and whether a warm start was kept.
+    """
+    info = {} if info is None else info
+    model = SARIMAX(
+        history,
+        order=tuple(order),
+        seasonal_order=(0,0,0,0),
+        enforce_stationarity=False,
+        enforce_invertibility=False
+    )
+    # Parameters of another order cannot warm-start this one
+    if start_params is not None and len(start_params) == len(model.param_names):
+        try:
+            res = model.fit(start_params=start_params, disp=False)
+            info['iterations'] = info.get('iterations', 0) + res.mle_retvals.get('iterations', 0)
+            if res.mle_retvals.get('converged', True):
+                info['warm'] = True
+                return res
+        except:
+            pass
+    res = model.fit(disp=False)
+    info['iterations'] = info.get('iterations', 0) + res.mle_retvals.get('iterations', 0)
+    info.setdefault('warm', False)
+    return res
+
+
+def css_aic(history, order):
+    """AIC approximated from a Hannan-Rissanen least-squares fit (no likelihood optimization)"""
+    p, d, q = order
+    y = np.diff(np.asarray(history, dtype=float), n=d)
+    if len(y) <= 2 * (p + q) + 2:
+        return np.inf
+    try:
+        params, _ = hannan_rissanen(y, ar_order=p, ma_order=q, demean=False)
+        sigma2 = float(params.sigma2)
+    except:
+        return np.inf
+    if not np.isfinite(sigma2):
+        return np.inf
+    return len(y) * np.log(max(sigma2, 1e-12)) + 2 * (p + q + 1)
+
+
+def select_order(history, keep=3, info=None):
+    """(order, results) of the ORDER_GRID candidate with the lowest AIC, or
+    (DEFAULT_ORDER, None) when no candidate can be fitted.
+
+    Every candidate is ranked by css_aic; only the `keep` best get a full
+    MLE fit, whose AIC decides. The winning fit is returned for reuse.
+    """
+    scored = [(css_aic(history, order), order) for order in ORDER_GRID]
+    ranked = [order for aic, order in sorted(scored) if np.isfinite(aic)][:keep]
+    best, best_res = DEFAULT_ORDER, None
+    for order in ranked:
+        try:
+            res = fit_sarima(history, info=info, order=order)
+        except:
+            continue
+        if np.isfinite(res.aic) and (best_res is None or res.aic < best_res.aic):
+            best, best_res = order, res
+    return best, best_res
+
+
+def evaluate_and_forecast(series, start_year, end_year, refit_threshold=None, start_params=None,
+                          info=None, order=DEFAULT_ORDER, fitted=None):
+    """
+    Fit once on all but last year, evaluate on last year, then extend the
+    fitted results with the last year (same parameters) and forecast.
+    The full series is re-optimized only when the held-out absolute error
+    exceeds `refit_threshold` (None = never), or when the series is too
+    short to evaluate. Fits start from `start_params` (previous run) when
+    given. `fitted`: results of `order` already estimated on all but last
+    year (on the whole series when too short), used instead of that fit.
+    Returns (eval_res, preds, params).
+    """
+    steps = end_year - start_year + 1
+    res, eval_res = None, None
+
+    if len(series) >= 5:  # SARIMA needs enough points
+        test_y = series[-1]
+        try:
+            res = fitted if fitted is not None else fit_sarima(series[:-1], start_params, info, order)
+            pred = res.forecast(steps=1)[0]
+            eval_res = {
+                "mae": abs(test_y - pred),
+                "rmse": np.sqrt((test_y - pred) ** 2),
+                "r2": None  # R² not meaningful for single-step per series
+            }
+            # Last year appended to the fitted state space, parameters kept
+            res = res.append(series[-1:])
+        except:
+            res = None
+
+    if len(series) < 5:
+        res = fitted
+    try:
+        if res is None or (refit_threshold is not None and eval_res["mae"] > refit_threshold):
+            res = fit_sarima(list(series), start_params, info, order)
+        return eval_res, res.forecast(steps=steps).tolist(), np.asarray(res.params).tolist()
+    except:
+        return eval_res, None, None
+
+
+def fit_series(task, start_year, end_year, refit_threshold=None, start_params=None, order=None,
+               auto_order=False):
+    """task = (pollutant, location_id, years, values)
+    -> (pollutant, location_id, eval_res, preds, params, fit_info)
+
+    fit_info = {'warm', 'iterations', 'seconds', 'order', 'selected'} of the
+    optimizer runs. Without an `order`, auto_order searches one on the
+    training part of the series (selected=True) and reuses the winning fit,
+    else DEFAULT_ORDER is used.
+    """
+    pollutant, location_id, years, values = task
+    info = {'warm': False, 'iterations': 0, 'selected': False}
+    start = time.perf_counter()
+    fitted = None
+    if order is None and auto_order:
+        order, fitted = select_order(values[:-1] if len(values) >= 5 else values, info=info)
+        info['selected'] = True  # the fallback is cached too, so the search is not rerun
+    info['order'] = tuple(order or DEFAULT_ORDER)
+    eval_res, preds, params = evaluate_and_forecast(values, start_year, end_year, refit_threshold,
+                                                    start_params, info, info['order'], fitted)
+    info['seconds'] = time.perf_counter() - start
+    return pollutant, location_id, eval_res, preds, params, info
+
+
+def _fit_chunk(chunk, start_year, end_year, refit_threshold=None, auto_order=False):
+    return [fit_series(task, start_year, end_year, refit_threshold, start_params, order, auto_order)
+            for task, start_params, order in chunk]
+
+
+def _location_chunks(tasks, chunk_size):
+    """Chunks of about `chunk_size` tasks that never split the adjacent tasks of a location"""
+    chunks = []
+    for item in tasks:
+        location_id = item[0][1]
+        if chunks and (len(chunks[-1]) < chunk_size or chunks[-1][-1][0][1] == location_id):
+            chunks[-1].append(item)
+        else:
+            chunks.append([item])
+    return chunks
+
+
+def _init_worker(blas_threads):
+    if threadpool_limits is not None:
+        threadpool_limits(blas_threads)
+
+
+@contextmanager
+def blas_limited_pool(workers, blas_threads=1):
+    """ProcessPoolExecutor whose workers use at most `blas_threads` BLAS threads each"""
+    # Workers are spawned, not forked: a forked worker inherits the BLAS already
+    # initialised by the parent and would ignore these variables when numpy loads
+    saved = {var: os.environ.get(var) for var in BLAS_ENV_VARS}
+    os.environ.update({var: str(blas_threads) for var in BLAS_ENV_VARS})
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(blas_threads,)) as executor:
+            yield executor
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+def run_sarima_tasks(tasks, start_year, end_year, workers=None, chunk_size=32, blas_threads=1,
+                     refit_threshold=None, start_params=None, auto_order=False, orders=None):
+    """Fit every task and return the results in the order of `tasks`.
+
+    Tasks are sent to a process pool in chunks of about `chunk_size` series
+    to amortize pickling; a chunk holds every adjacent task of a location. Each worker is limited to `blas_threads` BLAS threads
+    so `workers` processes do not oversubscribe the cores. workers=1 runs
+    in the current process. refit_threshold: see evaluate_and_forecast.
+    start_params: {(pollutant, location_id): params} to warm-start the fits.
+    auto_order: select the order of each series without one in
+    `orders` {(pollutant, location_id): (p, d, q)}; the search runs in the
+    workers with the fit.
+    """
+    start_params, orders = start_params or {}, orders or {}
+    tasks = [(task, start_params.get((task[0], task[1])), orders.get((task[0], task[1])))
+             for task in tasks]
+    fit_chunk = partial(_fit_chunk, start_year=start_year, end_year=end_year,
+                        refit_threshold=refit_threshold, auto_order=auto_order)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return fit_chunk(tasks)
+
+    chunks = _location_chunks(tasks, chunk_size)
+    with blas_limited_pool(workers, blas_threads) as executor:
+        results = executor.map(fit_chunk, chunks)
+        return [result for chunk in results for result in chunk]
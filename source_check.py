@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import sys
+
+# --------------------------
+# Empreinte des fichiers sources bruts (sans pandas)
+# --------------------------
+# Code de sortie d'un staging qui n'a rien eu à faire (lu par run_etl.py)
+SKIPPED_EXIT_CODE = 3
+
+# Statuts renvoyés par les run(config) des étapes
+OK, SKIPPED = 'ok', 'skipped'
+
+HASH_DIR = "hash"
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def code_version(code_files):
+    """Version du code de nettoyage = md5 des fichiers Python concernés"""
+    h = hashlib.md5()
+    for path in code_files:
+        h.update(os.path.basename(path).encode() + b"\0")
+        h.update(file_digest(path).encode())
+    return h.hexdigest()
+
+
+def _state_file(stage):
+    return os.path.join(HASH_DIR, f"sources_{stage}.json")
+
+
+def _load_state(stage):
+    try:
+        with open(_state_file(stage), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def source_signature(paths, code_files, previous=None):
+    """Taille, mtime et digest de chaque source + version du code.
+
+    Si taille et mtime n'ont pas bougé, le digest précédent est réutilisé
+    (pas de relecture du fichier).
+    """
+    previous_sources = (previous or {}).get("sources", {})
+    sources = {}
+    for path in paths:
+        st = os.stat(path)
+        old = previous_sources.get(path)
+        if old and old["size"] == st.st_size and old["mtime"] == st.st_mtime_ns:
+            digest = old["digest"]
+        else:
+            digest = file_digest(path)
+        sources[path] = {"size": st.st_size, "mtime": st.st_mtime_ns, "digest": digest}
+    return {"sources": sources, "code": code_version(code_files)}
+
+
+def _same_content(a, b):
+    if a is None or a["code"] != b["code"] or a["sources"].keys() != b["sources"].keys():
+        return False
+    return all(a["sources"][p]["digest"] == b["sources"][p]["digest"] for p in b["sources"])
+
+
+def check_sources(stage, paths, code_files, force=False):
+    """Renvoie (inchangé, signature) ; la signature est à passer à record_sources()"""
+    previous = _load_state(stage)
+    try:
+        current = source_signature(paths, code_files, previous)
+    except OSError:
+        return False, None  # source absente : laisser le staging remonter l'erreur
+    if not force and _same_content(previous, current):
+        if current != previous:
+            _save_state(stage, current)  # simple touch : mettre à jour les mtimes
+        print(f" Sources et code inchangés pour {stage}, staging ignoré.")
+        return True, current
+    return False, current
+
+
+def exit_if_unchanged(stage, paths, code_files):
+    """Termine le processus (SKIPPED_EXIT_CODE) si sources et code sont inchangés.
+
+    À appeler avant les imports lourds ; `--force` désactive la vérification.
+    Renvoie la signature à enregistrer avec record_sources() en fin de staging.
+    """
+    unchanged, signature = check_sources(stage, paths, code_files, "--force" in sys.argv)
+    if unchanged:
+        sys.exit(SKIPPED_EXIT_CODE)
+    return signature
+
+
+def record_sources(stage, signature):
+    """À appeler à la fin d'un staging réussi, avec la signature lue au démarrage"""
+    if signature is not None:
+        _save_state(stage, signature)
+
+
+def _save_state(stage, state):
+    os.makedirs(HASH_DIR, exist_ok=True)
+    with open(_state_file(stage), "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
@@ -1,34 +1,42 @@
-from sqlalchemy import create_engine
+import sys
+from source_check import check_sources, exit_if_unchanged, record_sources, OK, SKIPPED
+
+# --------------------------
+# 0️⃣ Sources brutes : sortie immédiate si rien n'a changé (avant les imports lourds)
+# --------------------------
+file_path = r"data\who_ambient_air_quality_database_version_2024_(v6.1).xlsx"
+code_files = [__file__, 'read_cache.py', 'imputation.py', 'bulk_load.py', 'row_delta.py', 'fingerprint.py']
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    source_signature = exit_if_unchanged('d1', [file_path], code_files)
+
+from db import get_engine
 import pandas as pd
-import hashlib
 import time
 from sqlalchemy import text
-import sys
-sys.stdout.reconfigure(encoding='utf-8')
 import os
+from read_cache import read_excel_cached
+from imputation import impute_by_levels, format_report
+from bulk_load import copy_to_temp_table
+from row_delta import load_row_state, save_row_state, compute_delta, delete_keys
+from fingerprint import (dataset_fingerprint, column_digests, changed_columns,
+                         load_column_digests, save_column_digests)
 
 
 # --------------------------
-# 1️⃣ Paramètres PostgreSQL
+# 1️⃣ Engine PostgreSQL partagé (configuration dans db.py)
 # --------------------------
-user = 'myuser'
-password = 'strong_password'
-host = 'localhost'
-port = '5432'
-database = 'dwh_pollution'
-
-engine = create_engine(f'postgresql://{user}:{password}@{host}:{port}/{database}')
+engine = get_engine('staging_d1')
 
 # --------------------------
 # 2️⃣ Fonction de nettoyage
 # --------------------------
 def clean_dataset(file_path):
-    # Charger la feuille spécifique
-    df = pd.read_excel(file_path, sheet_name='Update 2024 (V6.1)')
-
-    # Supprimer colonnes inutiles
+    # Charger la feuille spécifique (cache Parquet), sans les colonnes inutiles
     cols_to_drop = ['reference', 'web_link', 'who_ms', 'population_source']
-    df.drop(columns=[c for c in cols_to_drop if c in df.columns], inplace=True)
+    df = read_excel_cached(file_path, sheet_name='Update 2024 (V6.1)',
+                           usecols=lambda c: c not in cols_to_drop)
 
     # Renommer colonnes
     df.rename(columns={
@@ -47,17 +55,13 @@ def clean_dataset(file_path):
     
     cols_cov_pollutants = ['pm10_temp_cov', 'pm25_temp_cov', 'no2_temp_cov']
 
-    # Imputation locale par city
-    for col in cols_pollutants + cols_cov_pollutants:
-        df[col] = df.groupby(['city'])[col].transform(lambda x: x.fillna(x.mean()))
-
-    # Fallback par pays si NaN
-    for col in cols_pollutants + cols_cov_pollutants:
-        df[col] = df.groupby(['country'])[col].transform(lambda x: x.fillna(x.mean()))
+    # Imputation locale par city, puis fallback par pays si NaN
+    report = impute_by_levels(df, [['city'], ['country']], cols_pollutants + cols_cov_pollutants)
+    print(f"  Imputation polluants ({format_report(report)})")
 
     # Population manquante
     if 'population' in df.columns:
-        df['population'] = df.groupby('country')['population'].transform(lambda x: x.fillna(x.mean()))
+        impute_by_levels(df, [['country']], ['population'])
 
     # Convertir latitude, longitude en float
     df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
@@ -73,14 +77,17 @@ def clean_dataset(file_path):
     # Supprimer doublons
     df = df.drop_duplicates(subset=['country', 'city', 'year'])
 
+    # Clé ville normalisée (jointure avec dw.dim_location)
+    df['city_key'] = df['city'].str.split('/', n=1).str[0]
+
     return df
 
 # --------------------------
 # 3️⃣ Fonction hash pour détecter changements
 # --------------------------
-def compute_hash(df):
-    df_bytes = df.to_csv(index=False).encode()
-    return hashlib.md5(df_bytes).hexdigest()
+def compute_hash(df, digests=None):
+    """Empreinte calculée colonne par colonne (sans texte CSV intermédiaire)"""
+    return dataset_fingerprint(df, digests)
 
 # --------------------------
 # 4️⃣ Fonctions UPSERT pour PostgreSQL
@@ -94,42 +101,50 @@ def add_timestamp_column():
     with engine.begin() as conn:
         conn.execute(text(sql))
     print("  Colonne updated_at vérifiée/ajoutée")
+
+def add_join_indexes(table_name='staging_d1'):
+    """Clé ville normalisée et index servant les jointures et la fenêtre updated_at de load_dw"""
+    sql = f"""
+    ALTER TABLE etl.{table_name}
+    ADD COLUMN IF NOT EXISTS city_key TEXT;
+    CREATE INDEX IF NOT EXISTS {table_name}_country_city_key_idx ON etl.{table_name} (country, city_key);
+    CREATE INDEX IF NOT EXISTS {table_name}_updated_at_idx ON etl.{table_name} (updated_at);
+    """
+    with engine.begin() as conn:
+        conn.execute(text(sql))
+    print(f"  Colonne city_key et index de jointure vérifiés pour {table_name}")
 def upsert_to_postgres(df, table_name='staging_d1'):
     """UPSERT : met à jour si existe, insère si nouveau"""
     
-    # 1. Créer une table temporaire
     temp_table = f"temp_{table_name}"
-    df.to_sql(temp_table, engine, 
-              schema='etl', 
-              if_exists='replace', 
-              index=False)
-    
-    # 2. UPSERT avec ON CONFLICT - TOUTES les colonnes
+
+    # 1. UPSERT avec ON CONFLICT - TOUTES les colonnes
     upsert_sql = f"""
     INSERT INTO etl.{table_name} (
         region, iso3, country, city, year,
         concentration_pm10, concentration_pm25, concentration_no2,
         pm10_temp_cov, pm25_temp_cov, no2_temp_cov,
-        station_type, population, latitude, longitude, updated_at
+        station_type, population, latitude, longitude, city_key, updated_at
     )
     SELECT
-        region::text,
-        iso3::text,
-        country::text,
-        city::text,
-        year::int,
-        concentration_pm10::double precision,
-        concentration_pm25::double precision,
-        concentration_no2::double precision,
-        pm10_temp_cov::double precision,
-        pm25_temp_cov::double precision,
-        no2_temp_cov::double precision,
-        station_type::text,
-        population::double precision,
-        latitude::double precision,
-        longitude::double precision,
+        region,
+        iso3,
+        country,
+        city,
+        year,
+        concentration_pm10,
+        concentration_pm25,
+        concentration_no2,
+        pm10_temp_cov,
+        pm25_temp_cov,
+        no2_temp_cov,
+        station_type,
+        population,
+        latitude,
+        longitude,
+        city_key,
         CURRENT_TIMESTAMP
-    FROM etl.{temp_table}
+    FROM {temp_table}
     ON CONFLICT (country, city, year) DO UPDATE SET
         region = EXCLUDED.region,
         iso3 = EXCLUDED.iso3,
@@ -143,20 +158,22 @@ def upsert_to_postgres(df, table_name='staging_d1'):
         population = EXCLUDED.population,
         latitude = EXCLUDED.latitude,
         longitude = EXCLUDED.longitude,
+        city_key = EXCLUDED.city_key,
         updated_at = CURRENT_TIMESTAMP;
     """
 
     
+    # 2. COPY dans une table TEMPORARY typée (supprimée au COMMIT), puis UPSERT
     with engine.begin() as conn:
+        copy_to_temp_table(conn, df, temp_table)
         conn.execute(text(upsert_sql))
-        # Supprimer la table temporaire
-        conn.execute(text(f"DROP TABLE etl.{temp_table}"))
     
     print(f" UPSERT effectué pour {table_name}")
 def load_to_postgres(df):
     """Initial load - à utiliser seulement pour la première fois"""
     # D'abord créer la table avec updated_at
     add_timestamp_column()
+    add_join_indexes()
     
     # Puis faire un UPSERT qui agira comme un INSERT complet
     upsert_to_postgres(df)
@@ -195,56 +212,90 @@ new_data = {
 new_df = pd.DataFrame(new_data)
 # 5️⃣ Pipeline automatique
 # --------------------------
-file_path = r"data\who_ambient_air_quality_database_version_2024_(v6.1).xlsx"
-
-# Créer dossier hash
-hash_dir = "hash"
-os.makedirs(hash_dir, exist_ok=True)
-hash_file = os.path.join(hash_dir, "hash_d1.txt")
-
-# Vérifier hash précédent
-if os.path.exists(hash_file):
-    with open(hash_file, "r") as f:
-        previous_hash = f.read().strip()
-else:
-    previous_hash = None
-
-print(" Vérification des changements...")
-
-df = clean_dataset(file_path)
-output_dir = "staging_csv"
-os.makedirs(output_dir, exist_ok=True)  # créer le dossier si nécessaire
-
-csv_file = os.path.join(output_dir, "staging_d1.csv")
-df.to_csv(csv_file, index=False, encoding='utf-8')
-print(f" Données du staging sauvegardées dans {csv_file}")
-
-new_hash = compute_hash(df)
-
-if new_hash != previous_hash:
-    print(" Modifications détectées → Mise à jour PostgreSQL...")
-    
-    # 1. Ajouter la colonne timestamp si nécessaire
-    add_timestamp_column()
-    # 2. Faire l'UPSERT avec les données principales
-    upsert_to_postgres(df)
-    
-    # 3. UPSERT des données de test (comme avant)
-    #upsert_to_postgres(new_df)    
-
-    
-    # 4. Supprimer les données de test (comme avant)
-    #delete_rows_safe("X")
-
-    # 5. Sauvegarder nouveau hash
-    with open(hash_file, "w") as f:
-        f.write(new_hash)
-    
-    print(" Mise à jour UPSERT terminée avec succès")
-    
-else:
-    print(" Aucune modification trouvée, rien à faire.")
-
-
 
+def run(config=None):
+    """Exécute le staging d1 ; config : engine, force, path, source_signature.
 
+    Renvoie SKIPPED si sources et code de nettoyage sont inchangés, OK sinon.
+    """
+    global engine
+    config = config or {}
+    if config.get('engine') is not None:
+        engine = config['engine']
+    path = config.get('path', file_path)
+
+    signature = config.get('source_signature')
+    if signature is None:
+        unchanged, signature = check_sources('d1', [path], code_files, config.get('force', False))
+        if unchanged:
+            return SKIPPED
+
+    # Créer dossier hash
+    hash_dir = "hash"
+    os.makedirs(hash_dir, exist_ok=True)
+    hash_file = os.path.join(hash_dir, "hash_d1.txt")
+    row_state_file = os.path.join(hash_dir, "rows_d1.csv")
+    columns_file = os.path.join(hash_dir, "columns_d1.json")
+    key_cols = ['country', 'city', 'year']
+
+    # Vérifier hash précédent
+    if os.path.exists(hash_file):
+        with open(hash_file, "r") as f:
+            previous_hash = f.read().strip()
+    else:
+        previous_hash = None
+
+    print(" Vérification des changements...")
+
+    df = clean_dataset(path)
+    output_dir = "staging_csv"
+    os.makedirs(output_dir, exist_ok=True)  # créer le dossier si nécessaire
+
+    csv_file = os.path.join(output_dir, "staging_d1.csv")
+    df.to_csv(csv_file, index=False, encoding='utf-8')
+    print(f" Données du staging sauvegardées dans {csv_file}")
+
+    column_hashes = column_digests(df)
+    new_hash = compute_hash(df, column_hashes)
+
+    if new_hash != previous_hash:
+        print(" Modifications détectées → Mise à jour PostgreSQL...")
+        modified = changed_columns(load_column_digests(columns_file), column_hashes)
+        print(f"  Colonnes modifiées : {', '.join(modified)}")
+
+        # 1. Ajouter la colonne timestamp si nécessaire
+        add_timestamp_column()
+        add_join_indexes()
+        # 2. UPSERT des seules lignes nouvelles/modifiées + suppression des clés disparues
+        previous_rows = load_row_state(row_state_file, key_cols)
+        changed, deleted, row_state = compute_delta(df, key_cols, previous_rows)
+        print(f"  {len(changed)} lignes nouvelles/modifiées, {len(deleted)} supprimées")
+        if not changed.empty:
+            upsert_to_postgres(changed)
+        delete_keys(engine, deleted, 'staging_d1', key_cols)
+        save_row_state(row_state_file, row_state)
+
+        # 3. UPSERT des données de test (comme avant)
+        #upsert_to_postgres(new_df)    
+
+
+        # 4. Supprimer les données de test (comme avant)
+        #delete_rows_safe("X")
+
+        # 5. Sauvegarder nouveau hash
+        with open(hash_file, "w") as f:
+            f.write(new_hash)
+        save_column_digests(columns_file, column_hashes)
+
+        print(" Mise à jour UPSERT terminée avec succès")
+
+    else:
+        print(" Aucune modification trouvée, rien à faire.")
+
+    # Enregistrer l'empreinte des sources lue au démarrage
+    record_sources('d1', signature)
+    return OK
+
+
+if __name__ == "__main__":
+    run({'source_signature': source_signature})
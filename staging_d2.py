@@ -1,22 +1,33 @@
-from sqlalchemy import create_engine
+import sys
+from source_check import check_sources, exit_if_unchanged, record_sources, OK, SKIPPED
+
+# --------------------------
+# 0️⃣ Sources brutes : sortie immédiate si rien n'a changé (avant les imports lourds)
+# --------------------------
+file_path_d2 = r"data\Book1.xlsx"
+code_files = [__file__, 'read_cache.py', 'imputation.py', 'bulk_load.py', 'row_delta.py', 'fingerprint.py']
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    source_signature = exit_if_unchanged('d2', [file_path_d2], code_files)
+
+from db import get_engine
 import pandas as pd
-import hashlib
+import numpy as np
 import time
 from sqlalchemy import text
-import sys
-sys.stdout.reconfigure(encoding='utf-8')
 import os 
+from read_cache import read_excel_cached
+from imputation import impute_by_levels, format_report
+from bulk_load import copy_to_temp_table
+from row_delta import load_row_state, save_row_state, compute_delta, delete_keys
+from fingerprint import (dataset_fingerprint, column_digests, changed_columns,
+                         load_column_digests, save_column_digests)
 
 # --------------------------
-# 1️⃣ Paramètres PostgreSQL
+# 1️⃣ Engine PostgreSQL partagé (configuration dans db.py)
 # --------------------------
-user = 'myuser'
-password = 'strong_password'
-host = 'localhost'
-port = '5432'
-database = 'dwh_pollution'
-
-engine = create_engine(f'postgresql://{user}:{password}@{host}:{port}/{database}')
+engine = get_engine('staging_d2')
 
 # --------------------------
 # 2️⃣ Fonction de nettoyage
@@ -27,7 +38,7 @@ def clean_dataset(file_path_d1=None, file_path_d2=None):
     # --------------------------
     df1=None
     if file_path_d1:
-        df1 = pd.read_excel(file_path_d1, sheet_name='Source_Apportionment_DB_WHO')
+        df1 = read_excel_cached(file_path_d1, sheet_name='Source_Apportionment_DB_WHO')
         df1 = df1.iloc[:527]  # si tu veux limiter
         df1 = df1.rename(columns={
             'Site Location': 'city',
@@ -81,50 +92,51 @@ def clean_dataset(file_path_d1=None, file_path_d2=None):
         df1 = df1.groupby(group_cols, as_index=False).agg(agg_dict)
 
         # Fallback valeurs manquantes
-        for col in ['concentration_pm10', 'concentration_pm25']:
-            df1[col] = df1.groupby(['city','year'])[col].transform(lambda x: x.fillna(x.mean()))
-            df1[col] = df1.groupby(['country','year'])[col].transform(lambda x: x.fillna(x.mean()))
-            df1[col] = df1.groupby(['country'])[col].transform(lambda x: x.fillna(x.mean()))
+        report = impute_by_levels(
+            df1, [['city','year'], ['country','year'], ['country']],
+            ['concentration_pm10', 'concentration_pm25']
+        )
+        print(f"  Imputation concentrations ({format_report(report)})")
 
         source_cols = ['sea_salt','traffic','industry','dust','biomass_burn','other_source']
-        for col in source_cols:
-            df1[col] = df1.groupby(['city','year'])[col].transform(lambda x: x.fillna(x.mean()))
-            df1[col] = df1.groupby(['city'])[col].transform(lambda x: x.fillna(x.mean()))
-            df1[col] = df1.groupby(['country','year'])[col].transform(lambda x: x.fillna(x.mean()))
-            df1[col] = df1.groupby(['country'])[col].transform(lambda x: x.fillna(x.mean()))
+        report = impute_by_levels(
+            df1, [['city','year'], ['city'], ['country','year'], ['country']],
+            source_cols
+        )
+        print(f"  Imputation sources ({format_report(report)})")
 
     # --------------------------
     # 2️⃣ Nettoyage staging_d2
     # --------------------------
 
     if file_path_d2:
-        df2 = pd.read_excel(file_path_d2)
-
-        def expand_years_dash_only(value):
-            if pd.isna(value) or str(value).strip() in ['-', '????', '']:
-                return []
-            years = []
-            for p in str(value).split('-'):
-                try:
-                    years.append(int(float(p)))
-                except:
-                    pass
-            return years if years else []
+        df2 = read_excel_cached(file_path_d2)
 
         def split_rows_by_dash_years(df, col='year'):
-            rows = []
-            for _, row in df.iterrows():
-                year_values = expand_years_dash_only(row[col])
-                if not year_values:
-                    new_row = row.copy()
-                    new_row[col] = pd.NA
-                    rows.append(new_row)
-                else:
-                    for y in year_values:
-                        new_row = row.copy()
-                        new_row[col] = y
-                        rows.append(new_row)
-            return pd.DataFrame(rows)
+            """Une ligne par année de '2005-2006' ; '-', '????' et vide → NA.
+
+            Version vectorisée (split + explode) : les fragments non numériques
+            sont ignorés et les dtypes des autres colonnes sont conservés.
+            """
+            raw = df[col].reset_index(drop=True)
+            text = raw.astype('string').str.strip()
+            text = text.mask(raw.isna() | text.isin(['-', '????', '']))
+
+            # Un fragment par ligne, index = position de la ligne d'origine
+            fragments = text.str.split('-').explode().str.strip()
+            years = pd.to_numeric(fragments, errors='coerce').astype('float64')
+            years = years[np.isfinite(years)]
+
+            # Lignes sans aucune année valide → une seule ligne avec NA
+            positions = years.index.to_numpy()
+            no_year = np.setdiff1d(np.arange(len(raw)), positions)
+            positions = np.concatenate([positions, no_year])
+            values = np.concatenate([np.trunc(years.to_numpy()), np.full(len(no_year), np.nan)])
+
+            order = np.argsort(positions, kind='stable')
+            out = df.iloc[positions[order]].copy()
+            out[col] = pd.array(values[order], dtype='Float64').astype('Int64')
+            return out
 
         # Étape 1 : Expansion des années
         df2 = split_rows_by_dash_years(df2, col='study_year')
@@ -200,6 +212,9 @@ def clean_dataset(file_path_d1=None, file_path_d2=None):
         # Étape 5 : Conversion des types
         for col, dtype in expected_columns.items():
             if col in df2.columns:
+                # Colonne numérique déjà au bon dtype (conservé par l'expansion des années)
+                if dtype != 'string' and df2[col].dtype == dtype:
+                    continue
                 try:
                     if dtype == 'string':
                         df2[col] = df2[col].astype(str).replace('nan', '').replace('None', '')
@@ -276,15 +291,18 @@ def clean_dataset(file_path_d1=None, file_path_d2=None):
         final_duplicates = df2.duplicated(subset=key_cols).sum()
         if final_duplicates > 0:
             df2 = df2.drop_duplicates(subset=key_cols, keep='first')
+
+        # Clé ville normalisée (jointure avec dw.dim_location)
+        df2['city_key'] = df2['city'].str.split('/', n=1).str[0]
     
     return df1, df2
 
 # --------------------------
 # 3️⃣ Fonction hash pour détecter changements
 # --------------------------
-def compute_hash(df):
-    df_bytes = df.to_csv(index=False).encode()
-    return hashlib.md5(df_bytes).hexdigest()
+def compute_hash(df, digests=None):
+    """Empreinte calculée colonne par colonne (sans texte CSV intermédiaire)"""
+    return dataset_fingerprint(df, digests)
 
 # --------------------------
 # 4️⃣ Fonctions UPSERT pour PostgreSQL
@@ -299,65 +317,40 @@ def add_timestamp_column(table_name='staging_d2'):
         conn.execute(text(sql))
     print(f"  Colonne updated_at vérifiée/ajoutée pour {table_name}")
 
-from sqlalchemy.types import Numeric, Integer, Text
+def add_join_indexes(table_name='staging_d2'):
+    """Clé ville normalisée et index servant les jointures et la fenêtre updated_at de load_dw"""
+    sql = f"""
+    ALTER TABLE etl.{table_name}
+    ADD COLUMN IF NOT EXISTS city_key TEXT;
+    CREATE INDEX IF NOT EXISTS {table_name}_country_city_key_idx ON etl.{table_name} (country, city_key);
+    CREATE INDEX IF NOT EXISTS {table_name}_updated_at_idx ON etl.{table_name} (updated_at);
+    """
+    with engine.begin() as conn:
+        conn.execute(text(sql))
+    print(f"  Colonne city_key et index de jointure vérifiés pour {table_name}")
+
 from sqlalchemy import text
 
 def upsert_to_postgres(df, table_name='staging_d2'):
     """UPSERT : met à jour si existe, insère si nouveau"""
     
-    # 1. Créer une table temporaire
     temp_table = f"temp_{table_name}"
-    
-    # Définir les types pour chaque colonne
-    dtype_mapping = {
-        'country': Text(),
-        'city': Text(),
-        'year': Integer(),
-        'study_year': Integer(),
-        'concentration_pm10': Numeric(),
-        'concentration_pm25': Numeric(),
-        'sea_salt': Numeric(),
-        'dust': Numeric(),
-        'traffic': Numeric(),
-        'industry': Numeric(),
-        'biomass_burn': Numeric(),
-        'other_source': Numeric(),
-        'methodology': Text(),
-        'reference_author': Text(),
-        'site_typology': Text(),
-        'population': Integer(),
-        'iso3': Text(),
-        'region': Text(),
-        'continent': Text(),
-        'latitude': Numeric(),
-        'longitude': Numeric(),
-        'season': Text()
-    }
-    
-    # Garder seulement les colonnes qui existent dans le DataFrame
-    existing_dtypes = {k: v for k, v in dtype_mapping.items() if k in df.columns}
-    
-    df.to_sql(temp_table, engine, 
-              schema='etl', 
-              if_exists='replace', 
-              index=False,
-              dtype=existing_dtypes)
-    
-    # 2. UPSERT avec ON CONFLICT
+
+    # 1. UPSERT avec ON CONFLICT
     upsert_sql = f"""
     INSERT INTO etl.{table_name} (
     country, city, year, methodology, iso3, region, continent,
     concentration_pm10, concentration_pm25, study_year,
     sea_salt, dust, traffic, industry, biomass_burn, other_source,
     reference_author, site_typology, population,
-    latitude, longitude, season, updated_at
+    latitude, longitude, season, city_key, updated_at
 )
     SELECT     country, city, year, methodology, iso3, region, continent,
-    concentration_pm10::numeric, concentration_pm25::numeric, study_year::numeric,
-    sea_salt::numeric, dust::numeric, traffic::numeric, industry::numeric, biomass_burn::numeric, other_source::numeric,
-    reference_author, site_typology, population::numeric,
-    latitude::numeric, longitude::numeric, season, CURRENT_TIMESTAMP
-    FROM etl.{temp_table}
+    concentration_pm10, concentration_pm25, study_year,
+    sea_salt, dust, traffic, industry, biomass_burn, other_source,
+    reference_author, site_typology, population,
+    latitude, longitude, season, city_key, CURRENT_TIMESTAMP
+    FROM {temp_table}
     ON CONFLICT (country, city, year, methodology) DO UPDATE SET
         iso3 = EXCLUDED.iso3,
         region = EXCLUDED.region,
@@ -377,13 +370,14 @@ def upsert_to_postgres(df, table_name='staging_d2'):
         latitude = EXCLUDED.latitude,
         longitude = EXCLUDED.longitude,
         season = EXCLUDED.season,
+        city_key = EXCLUDED.city_key,
         updated_at = CURRENT_TIMESTAMP
     """
     
+    # 2. COPY dans une table TEMPORARY typée (supprimée au COMMIT), puis UPSERT
     with engine.begin() as conn:
+        copy_to_temp_table(conn, df, temp_table)
         conn.execute(text(upsert_sql))
-        # Supprimer la table temporaire
-        conn.execute(text(f"DROP TABLE etl.{temp_table}"))
     
     print(f" UPSERT effectué pour {table_name}")
 
@@ -391,6 +385,7 @@ def load_to_postgres(df):
     """Initial load - à utiliser seulement pour la première fois"""
     # D'abord créer la table avec updated_at
     add_timestamp_column()
+    add_join_indexes()
     
     # Puis faire un UPSERT qui agira comme un INSERT complet
     upsert_to_postgres(df)
@@ -412,49 +407,88 @@ def delete_rows_safe(city_name):
 # 5️⃣ Pipeline automatique
 # --------------------------
 file_path = r"data\database_source_apport_studies_v2_0_26_9_2015.xls"
-file_path_d2 = r"data\Book1.xlsx"
 
-# Créer dossier hash
-hash_dir = "hash"
-os.makedirs(hash_dir, exist_ok=True)
-hash_file = os.path.join(hash_dir, "hash_d2.txt")
 
-# Vérifier hash précédent
-if os.path.exists(hash_file):
-    with open(hash_file, "r") as f:
-        previous_hash = f.read().strip()
-else:
-    previous_hash = None
+def run(config=None):
+    """Exécute le staging d2 ; config : engine, force, path, source_signature.
 
-print(" Vérification des changements...")
+    Renvoie SKIPPED si sources et code de nettoyage sont inchangés, OK sinon.
+    """
+    global engine
+    config = config or {}
+    if config.get('engine') is not None:
+        engine = config['engine']
+    path = config.get('path', file_path_d2)
 
-_, df2 = clean_dataset(file_path_d1=None, file_path_d2=file_path_d2)
-output_dir = "staging_csv"
-os.makedirs(output_dir, exist_ok=True)  # créer le dossier si nécessaire
+    signature = config.get('source_signature')
+    if signature is None:
+        unchanged, signature = check_sources('d2', [path], code_files, config.get('force', False))
+        if unchanged:
+            return SKIPPED
 
-csv_file = os.path.join(output_dir, "staging_d2.csv")
-df2.to_csv(csv_file, index=False, encoding='utf-8')
-print(f" Données du staging sauvegardées dans {csv_file}")
+    # Créer dossier hash
+    hash_dir = "hash"
+    os.makedirs(hash_dir, exist_ok=True)
+    hash_file = os.path.join(hash_dir, "hash_d2.txt")
+    row_state_file = os.path.join(hash_dir, "rows_d2.csv")
+    columns_file = os.path.join(hash_dir, "columns_d2.json")
+    key_cols = ['country', 'city', 'year', 'methodology']
 
-if df2 is None or df2.empty:
-    print(" Attention : df2 est vide, rien à charger.")
-else:
-    new_hash = compute_hash(df2)
+    # Vérifier hash précédent
+    if os.path.exists(hash_file):
+        with open(hash_file, "r") as f:
+            previous_hash = f.read().strip()
+    else:
+        previous_hash = None
 
-    if new_hash != previous_hash:
-        print(" Modifications détectées → Mise à jour PostgreSQL...")
-        
-        # Ajouter la colonne timestamp
-        add_timestamp_column()
-        
-        # Faire l'UPSERT au lieu de LOAD
-        upsert_to_postgres(df2)
-        
-        # Sauvegarder nouveau hash
-        with open(hash_file, "w") as f:
-            f.write(new_hash)
-        
-        print(" Mise à jour UPSERT terminée avec succès")
-        
+    print(" Vérification des changements...")
+
+    _, df2 = clean_dataset(file_path_d1=None, file_path_d2=path)
+    output_dir = "staging_csv"
+    os.makedirs(output_dir, exist_ok=True)  # créer le dossier si nécessaire
+
+    csv_file = os.path.join(output_dir, "staging_d2.csv")
+    df2.to_csv(csv_file, index=False, encoding='utf-8')
+    print(f" Données du staging sauvegardées dans {csv_file}")
+
+    if df2 is None or df2.empty:
+        print(" Attention : df2 est vide, rien à charger.")
     else:
-        print(" Aucune modification trouvée, rien à faire.")
\ No newline at end of file
+        column_hashes = column_digests(df2)
+        new_hash = compute_hash(df2, column_hashes)
+
+        if new_hash != previous_hash:
+            print(" Modifications détectées → Mise à jour PostgreSQL...")
+            modified = changed_columns(load_column_digests(columns_file), column_hashes)
+            print(f"  Colonnes modifiées : {', '.join(modified)}")
+
+            # Ajouter la colonne timestamp
+            add_timestamp_column()
+            add_join_indexes()
+
+            # UPSERT des seules lignes nouvelles/modifiées + suppression des clés disparues
+            previous_rows = load_row_state(row_state_file, key_cols)
+            changed, deleted, row_state = compute_delta(df2, key_cols, previous_rows)
+            print(f"  {len(changed)} lignes nouvelles/modifiées, {len(deleted)} supprimées")
+            if not changed.empty:
+                upsert_to_postgres(changed)
+            delete_keys(engine, deleted, 'staging_d2', key_cols)
+            save_row_state(row_state_file, row_state)
+
+            # Sauvegarder nouveau hash
+            with open(hash_file, "w") as f:
+                f.write(new_hash)
+            save_column_digests(columns_file, column_hashes)
+
+            print(" Mise à jour UPSERT terminée avec succès")
+
+        else:
+            print(" Aucune modification trouvée, rien à faire.")
+
+    # Enregistrer l'empreinte des sources lue au démarrage
+    record_sources('d2', signature)
+    return OK
+
+
+if __name__ == "__main__":
+    run({'source_signature': source_signature})
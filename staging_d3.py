@@ -1,26 +1,46 @@
-from sqlalchemy import create_engine, text
+import sys
+from source_check import check_sources, exit_if_unchanged, record_sources, OK, SKIPPED
+
+# --------------------------
+# 0️⃣ Sources brutes : sortie immédiate si rien n'a changé (avant les imports lourds)
+# --------------------------
+file_path_d3 = r"data\owid-co2-data.csv"
+code_files = [__file__, 'owid_reader.py', 'balance_fill.py', 'imputation.py', 'bulk_load.py', 'row_delta.py', 'fingerprint.py']
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    source_signature = exit_if_unchanged('d3', [file_path_d3], code_files)
+
+from sqlalchemy import text
+from db import get_engine
 import pandas as pd
-import hashlib
 import time
 import numpy as np
-import sys
-sys.stdout.reconfigure(encoding='utf-8')
 import os
+from owid_reader import read_owid_csv
+from balance_fill import fill_single_missing
+from imputation import impute_by_levels, format_report
+from bulk_load import copy_to_temp_table
+from row_delta import load_row_state, save_row_state, compute_delta, delete_keys
+from fingerprint import (dataset_fingerprint, column_digests, changed_columns,
+                         load_column_digests, save_column_digests)
 # --------------------------
-# 1️⃣ Paramètres PostgreSQL
+# 1️⃣ Engine PostgreSQL partagé (configuration dans db.py)
 # --------------------------
-user = 'myuser'
-password = 'strong_password'
-host = 'localhost'
-port = '5432'
-database = 'dwh_pollution'
-engine = create_engine(f'postgresql://{user}:{password}@{host}:{port}/{database}')
-
-def clean_dataset_d3(file_path_d3):
-    df2 = pd.read_csv(file_path_d3)
-
-    # Garder seulement après 1980
-    df2 = df2[df2['year'] > 1980]
+engine = get_engine('staging_d3')
+
+def clean_dataset_d3(file_path_d3, csv_engine=None):
+    # Lecture projetée (colonnes utilisées ci-dessous) et typée,
+    # en ne gardant que les années après 1980 dès la lecture
+    owid_columns = [
+        'country', 'year', 'iso_code', 'population',
+        'co2', 'cement_co2', 'coal_co2', 'consumption_co2', 'flaring_co2', 'gas_co2',
+        'oil_co2', 'other_industry_co2', 'other_co2', 'methane', 'nitrous_oxide',
+        'co2_per_capita', 'cement_co2_per_capita', 'coal_co2_per_capita', 'consumption_co2_per_capita',
+        'flaring_co2_per_capita', 'gas_co2_per_capita', 'oil_co2_per_capita',
+        'other_co2_per_capita', 'methane_per_capita', 'nitrous_oxide_per_capita'
+    ]
+    df2 = read_owid_csv(file_path_d3, owid_columns, min_year=1980, engine=csv_engine)
 
     # Colonnes polluants
     cols_polluant_emission = [
@@ -29,9 +49,8 @@ def clean_dataset_d3(file_path_d3):
     ]
 
     # 1️⃣ Imputation moyenne pays/année puis pays
-    for col in cols_polluant_emission:
-        df2[col] = df2.groupby(['country','year'])[col].transform(lambda x: x.fillna(x.mean()))
-        df2[col] = df2.groupby(['country'])[col].transform(lambda x: x.fillna(x.mean()))
+    report = impute_by_levels(df2, [['country','year'], ['country']], cols_polluant_emission)
+    print(f"  Imputation émissions ({format_report(report)})")
 
     # 2️⃣ Remplissage cohérent des polluants quand il manque UNE seule colonne
     cols_for_balance = [
@@ -39,31 +58,10 @@ def clean_dataset_d3(file_path_d3):
         'gas_co2','oil_co2','other_industry_co2'
     ]
 
-    def fill_missing_pollutant(row):
-        values = row[cols_for_balance]
-        missing = values[values.isna()].index
-
-        if len(missing) == 1:
-            miss = missing[0]
-            others = values.drop(miss)
-
-            if miss == 'co2':
-                return miss, others.sum()
-            else:
-                return miss, row['co2'] - others[others.index != 'co2'].sum()
-
-        return None, None
-
-    for idx, row in df2.iterrows():
-        missing_col, missing_val = fill_missing_pollutant(row)
-        if missing_col:
-            df2.at[idx, missing_col] = missing_val
+    fill_single_missing(df2, cols_for_balance, total_col='co2')
 
     # 3️⃣ Imputer GDP & population
-    if 'gdp' in df2.columns:
-        df2['gdp'] = df2.groupby('country')['gdp'].transform(lambda x: x.fillna(x.mean()))
-
-    df2['population'] = df2.groupby('country')['population'].transform(lambda x: x.fillna(x.mean()))
+    impute_by_levels(df2, [['country']], ['gdp', 'population'])
 
     # 4️⃣ Colonnes per capita
     cols_per_capita = [
@@ -107,9 +105,9 @@ import pandas as pd
 # --------------------------
 # 3️⃣ Fonction hash pour détecter changements
 # --------------------------
-def compute_hash(df):
-    df_bytes = df.to_csv(index=False).encode()
-    return hashlib.md5(df_bytes).hexdigest()
+def compute_hash(df, digests=None):
+    """Empreinte calculée colonne par colonne (sans texte CSV intermédiaire)"""
+    return dataset_fingerprint(df, digests)
 
 # --------------------------
 # 4️⃣ Fonctions UPSERT pour PostgreSQL
@@ -124,17 +122,21 @@ def add_timestamp_column(table_name='staging_d3'):
         conn.execute(text(sql))
     print(f"  Colonne updated_at vérifiée/ajoutée pour {table_name}")
 
+def add_join_indexes(table_name='staging_d3'):
+    """Index servant la fenêtre updated_at de load_dw (la jointure pays passe par la clé (country, year))"""
+    sql = f"""
+    CREATE INDEX IF NOT EXISTS {table_name}_updated_at_idx ON etl.{table_name} (updated_at);
+    """
+    with engine.begin() as conn:
+        conn.execute(text(sql))
+    print(f"  Index de jointure vérifiés pour {table_name}")
+
 def upsert_to_postgres(df, table_name='staging_d3'):
     """UPSERT : met à jour si existe, insère si nouveau"""
     
-    # 1. Créer une table temporaire
     temp_table = f"temp_{table_name}"
-    df.to_sql(temp_table, engine, 
-              schema='etl', 
-              if_exists='replace', 
-              index=False)
-    
-    # 2. UPSERT avec ON CONFLICT - TOUTES les colonnes
+
+    # 1. UPSERT avec ON CONFLICT - TOUTES les colonnes
     upsert_sql = f"""
     INSERT INTO etl.{table_name} (
         cement_co2_pct, coal_co2_pct, flaring_co2_pct, gas_co2_pct, oil_co2_pct, other_industry_co2_pct,
@@ -145,38 +147,38 @@ def upsert_to_postgres(df, table_name='staging_d3'):
         methane, nitrous_oxide, country, year, iso_code, population, updated_at
     )
     SELECT
-        cement_co2_pct::double precision,
-        coal_co2_pct::double precision,
-        flaring_co2_pct::double precision,
-        gas_co2_pct::double precision,
-        oil_co2_pct::double precision,
-        other_industry_co2_pct::double precision,
-        cement_co2::double precision,
-        coal_co2::double precision,
-        consumption_co2::double precision,
-        flaring_co2::double precision,
-        gas_co2::double precision,
-        oil_co2::double precision,
-        other_industry_co2::double precision,
-        co2::double precision,
-        co2_per_capita::double precision,
-        cement_co2_per_capita::double precision,
-        coal_co2_per_capita::double precision,
-        consumption_co2_per_capita::double precision,
-        flaring_co2_per_capita::double precision,
-        gas_co2_per_capita::double precision,
-        oil_co2_per_capita::double precision,
-        other_co2_per_capita::double precision,
-        methane_per_capita::double precision,
-        nitrous_oxide_per_capita::double precision,
-        methane::double precision,
-        nitrous_oxide::double precision,
-        country::text,
-        year::int,
-        iso_code::text,
-        population::double precision,
+        cement_co2_pct,
+        coal_co2_pct,
+        flaring_co2_pct,
+        gas_co2_pct,
+        oil_co2_pct,
+        other_industry_co2_pct,
+        cement_co2,
+        coal_co2,
+        consumption_co2,
+        flaring_co2,
+        gas_co2,
+        oil_co2,
+        other_industry_co2,
+        co2,
+        co2_per_capita,
+        cement_co2_per_capita,
+        coal_co2_per_capita,
+        consumption_co2_per_capita,
+        flaring_co2_per_capita,
+        gas_co2_per_capita,
+        oil_co2_per_capita,
+        other_co2_per_capita,
+        methane_per_capita,
+        nitrous_oxide_per_capita,
+        methane,
+        nitrous_oxide,
+        country,
+        year,
+        iso_code,
+        population,
         CURRENT_TIMESTAMP
-    FROM etl.{temp_table}
+    FROM {temp_table}
     ON CONFLICT (country, year) DO UPDATE SET
         cement_co2_pct = EXCLUDED.cement_co2_pct,
         coal_co2_pct = EXCLUDED.coal_co2_pct,
@@ -209,10 +211,10 @@ def upsert_to_postgres(df, table_name='staging_d3'):
         updated_at = CURRENT_TIMESTAMP;
     """
     
+    # 2. COPY dans une table TEMPORARY typée (supprimée au COMMIT), puis UPSERT
     with engine.begin() as conn:
+        copy_to_temp_table(conn, df, temp_table)
         conn.execute(text(upsert_sql))
-        # Supprimer la table temporaire
-        conn.execute(text(f"DROP TABLE etl.{temp_table}"))
     
     print(f" UPSERT effectué pour {table_name}")
 
@@ -220,6 +222,7 @@ def load_to_postgres(df):
     """Initial load - à utiliser seulement pour la première fois"""
     # D'abord créer la table avec updated_at
     add_timestamp_column('staging_d3')
+    add_join_indexes('staging_d3')
     
     # Puis faire un UPSERT qui agira comme un INSERT complet
     upsert_to_postgres(df, 'staging_d3')
@@ -278,55 +281,93 @@ new_df = pd.DataFrame(new_data)
 # --------------------------
 # 5️⃣ Pipeline automatique
 # --------------------------
-file_path_d3 = r"data\owid-co2-data.csv"
 
-# Créer dossier hash
-hash_dir = "hash"
-os.makedirs(hash_dir, exist_ok=True)
-hash_file = os.path.join(hash_dir, "hash_d3.txt")
-
-# Vérifier hash précédent
-if os.path.exists(hash_file):
-    with open(hash_file, "r") as f:
-        previous_hash = f.read().strip()
-else:
-    previous_hash = None
-
-print(" Vérification des changements...")
-
-df3 = clean_dataset_d3(file_path_d3)
-output_dir = "staging_csv"
-os.makedirs(output_dir, exist_ok=True)  # créer le dossier si nécessaire
-
-csv_file = os.path.join(output_dir, "staging_d3.csv")
-df3.to_csv(csv_file, index=False, encoding='utf-8')
-print(f" Données du staging sauvegardées dans {csv_file}")
-
-if df3 is None or df3.empty:
-    print(" Attention : df3 est vide, rien à charger.")
-else:
-    new_hash = compute_hash(df3)
-
-    if new_hash != previous_hash:
-        print(" Modifications détectées → Mise à jour PostgreSQL...")
-        
-        # 1. Ajouter la colonne timestamp si nécessaire
-        add_timestamp_column('staging_d3')
-        
-        # 2. Faire l'UPSERT avec les données principales
-        upsert_to_postgres(df3, 'staging_d3')
-        
-        # 3. UPSERT des données de test (optionnel - commenté)
-        # upsert_to_postgres(new_df, 'staging_d3')
-        
-        # 4. Supprimer les données de test (optionnel - commenté)
-        # delete_rows_safe("X")
-        
-        # 5. Sauvegarder nouveau hash
-        with open(hash_file, "w") as f:
-            f.write(new_hash)
-        
-        print(" Mise à jour UPSERT terminée avec succès")
-        
+def run(config=None):
+    """Exécute le staging d3 ; config : engine, force, path, source_signature, csv_engine.
+
+    Renvoie SKIPPED si sources et code de nettoyage sont inchangés, OK sinon.
+    """
+    global engine
+    config = config or {}
+    if config.get('engine') is not None:
+        engine = config['engine']
+    path = config.get('path', file_path_d3)
+
+    signature = config.get('source_signature')
+    if signature is None:
+        unchanged, signature = check_sources('d3', [path], code_files, config.get('force', False))
+        if unchanged:
+            return SKIPPED
+
+    # Créer dossier hash
+    hash_dir = "hash"
+    os.makedirs(hash_dir, exist_ok=True)
+    hash_file = os.path.join(hash_dir, "hash_d3.txt")
+    row_state_file = os.path.join(hash_dir, "rows_d3.csv")
+    columns_file = os.path.join(hash_dir, "columns_d3.json")
+    key_cols = ['country', 'year']
+
+    # Vérifier hash précédent
+    if os.path.exists(hash_file):
+        with open(hash_file, "r") as f:
+            previous_hash = f.read().strip()
     else:
-        print(" Aucune modification trouvée, rien à faire.")
\ No newline at end of file
+        previous_hash = None
+
+    print(" Vérification des changements...")
+
+    df3 = clean_dataset_d3(path, csv_engine=config.get('csv_engine'))
+    output_dir = "staging_csv"
+    os.makedirs(output_dir, exist_ok=True)  # créer le dossier si nécessaire
+
+    csv_file = os.path.join(output_dir, "staging_d3.csv")
+    df3.to_csv(csv_file, index=False, encoding='utf-8')
+    print(f" Données du staging sauvegardées dans {csv_file}")
+
+    if df3 is None or df3.empty:
+        print(" Attention : df3 est vide, rien à charger.")
+    else:
+        column_hashes = column_digests(df3)
+        new_hash = compute_hash(df3, column_hashes)
+
+        if new_hash != previous_hash:
+            print(" Modifications détectées → Mise à jour PostgreSQL...")
+            modified = changed_columns(load_column_digests(columns_file), column_hashes)
+            print(f"  Colonnes modifiées : {', '.join(modified)}")
+
+            # 1. Ajouter la colonne timestamp si nécessaire
+            add_timestamp_column('staging_d3')
+            add_join_indexes('staging_d3')
+
+            # 2. UPSERT des seules lignes nouvelles/modifiées + suppression des clés disparues
+            previous_rows = load_row_state(row_state_file, key_cols)
+            changed, deleted, row_state = compute_delta(df3, key_cols, previous_rows)
+            print(f"  {len(changed)} lignes nouvelles/modifiées, {len(deleted)} supprimées")
+            if not changed.empty:
+                upsert_to_postgres(changed, 'staging_d3')
+            delete_keys(engine, deleted, 'staging_d3', key_cols)
+            save_row_state(row_state_file, row_state)
+
+            # 3. UPSERT des données de test (optionnel - commenté)
+            # upsert_to_postgres(new_df, 'staging_d3')
+
+            # 4. Supprimer les données de test (optionnel - commenté)
+            # delete_rows_safe("X")
+
+            # 5. Sauvegarder nouveau hash
+            with open(hash_file, "w") as f:
+                f.write(new_hash)
+            save_column_digests(columns_file, column_hashes)
+
+            print(" Mise à jour UPSERT terminée avec succès")
+
+        else:
+            print(" Aucune modification trouvée, rien à faire.")
+
+    # Enregistrer l'empreinte des sources lue au démarrage
+    record_sources('d3', signature)
+    return OK
+
+
+if __name__ == "__main__":
+    run({'source_signature': source_signature})